@@ -1,8 +1,8 @@
+import os
+
 import click
 
 from podao.constant import ALL_GROUP_NAME
-from podao.main import Project
-from podao.util import check_pyenv, check_pyvenv
 
 
 '''
@@ -12,9 +12,46 @@ TODO:
 '''
 
 
+# The command modules pull in sh, tomlkit and packaging, they are imported in
+# the commands so `pd --help` and mistyped commands only pay for click.
 @click.group
-def pd():
-    pass
+@click.option(
+    '--profile',
+    is_flag=True,
+    default=False,
+    envvar='PODAO_PROFILE',
+    help='Print the time spent in every phase and subprocess.',
+)
+@click.option(
+    '--profile-output',
+    type=click.Path(dir_okay=False, writable=True),
+    help='Write the profile to a file, implies --profile.',
+)
+@click.option(
+    '--profile-format',
+    type=click.Choice(['json', 'trace']),
+    default='json',
+    help='Profile file format, `trace` loads in chrome://tracing.',
+)
+@click.pass_context
+def pd(ctx, profile, profile_output, profile_format):
+    if not (profile or profile_output):
+        return
+
+    from podao.profile import profiler
+
+    profiler.enable()
+
+    def report():
+        profiler.disable()
+        click.secho('Profile:', bold=True, err=True)
+        for s in profiler.summary():
+            click.secho(f'    {s}', err=True)
+        if profile_output:
+            profiler.dump(profile_output, profile_format)
+            click.secho(f'    Written to {profile_output}', err=True)
+
+    ctx.call_on_close(report)
 
 
 @pd.command
@@ -26,27 +63,40 @@ def pd():
     type=click.Choice(['vscode'], case_sensitive=False),
     help='Generate IDE configuation file.',
 )
-def init(dir, python, ide=None):
+@click.option(
+    '--prebuilt',
+    type=click.Path(exists=True, file_okay=False),
+    envvar='PODAO_PREBUILT_DIR',
+    help='Directory of prebuilt python tarballs to use instead of compiling.',
+)
+@click.option(
+    '--offline',
+    is_flag=True,
+    default=False,
+    envvar='PODAO_OFFLINE',
+    help='Install from the local wheelhouse only, see `pd fetch`.',
+)
+def init(dir, python, ide=None, prebuilt=None, offline=False):
     '''
     Init project enviorment. E.g.\n
     pd init . 3.10.4
     '''
+    from podao.main import Project
+    from podao.util import check_pyenv, check_pyvenv
+
     if v := check_pyenv():
         click.secho(f'Using {v}', bold=True)
     else:
         click.secho('Warning: Cannot find pyenv, install it firstly!', fg='red', err=True)
         return
 
-    if check_pyvenv():
+    if check_pyvenv(dir, active=False):
         click.secho(f'Warning: Project environment already existed', fg='red', err=True)
         return
 
     try:
-        pro = Project(dir)
-        for s in pro.create_venv(python):
-            click.secho(s)
-
-        for s in pro.create_structure(ide):
+        pro = Project(dir, offline=offline)
+        for s in pro.init(python, ide, prebuilt):
             click.secho(s)
     except Exception as e:
         click.secho(e, fg='red', err=True)
@@ -67,12 +117,29 @@ def init(dir, python, ide=None):
     default='',
     help='Add packages to a specific group default ``.',
 )
-def install(dev, group, packages):
+@click.option(
+    '--store',
+    is_flag=True,
+    default=False,
+    envvar='PODAO_STORE',
+    help='Link packages from the shared wheel store instead of unpacking them.',
+)
+@click.option(
+    '--offline',
+    is_flag=True,
+    default=False,
+    envvar='PODAO_OFFLINE',
+    help='Install from the local wheelhouse only, see `pd fetch`.',
+)
+def install(dev, group, packages, store, offline):
     '''
     Install packages and add to specific group in pyproject.toml. \n
     Beware using quotes around specifiers in the shell when using >, <.  E.g.\n
     pd install 'requests<3.0.0,>=2.19.1'
     '''
+    from podao.main import Project
+    from podao.util import check_pyvenv
+
     if root := check_pyvenv():
         click.secho(f'Working on {root}')
     else:
@@ -86,7 +153,7 @@ def install(dev, group, packages):
         group = 'dev'
 
     try:
-        pro = Project(root)
+        pro = Project(root, store=store, offline=offline)
         for s in pro.install(packages, group):
             click.secho(s)
 
@@ -100,11 +167,20 @@ def install(dev, group, packages):
 
 @pd.command
 @click.argument('packages', nargs=-1)
-def uninstall(packages):
+@click.option(
+    '--prune',
+    is_flag=True,
+    default=False,
+    help='Also remove the dependencies nothing else needs any more.',
+)
+def uninstall(packages, prune):
     '''
     Uninstall packages and remove from the group in pyproject.toml. E.g.\n
     pd uninstall requests
     '''
+    from podao.main import Project
+    from podao.util import check_pyvenv
+
     if root := check_pyvenv():
         click.secho(f'Working on {root}')
     else:
@@ -119,7 +195,7 @@ def uninstall(packages):
 
     try:
         pro = Project(root)
-        for s in pro.uninstall(packages):
+        for s in pro.uninstall(packages, prune):
             click.secho(s)
 
     except Exception as e:
@@ -143,11 +219,52 @@ def uninstall(packages):
     default='',
     help='Take a group packages snapshot default `main`',
 )
-def freeze(dev, group, all):
+@click.option(
+    '--workspace',
+    '-w',
+    type=click.Path(exists=True, file_okay=False),
+    help='Take snapshots of every project environment under a workspace root.',
+)
+@click.option(
+    '--jobs', '-j', type=int, default=None, help='Maximum projects processed at once.'
+)
+@click.option(
+    '--hashes', is_flag=True, default=False, help='Add package hashes to the snapshot.'
+)
+@click.option(
+    '--each-group',
+    '-e',
+    is_flag=True,
+    default=False,
+    help='Take the main, every group and all packages snapshots at once.',
+)
+@click.option(
+    '--targets',
+    '-t',
+    is_flag=True,
+    default=False,
+    help='Take a snapshot per target in [tool.podao] instead of this environment.',
+)
+def freeze(dev, group, all, workspace, jobs, hashes, each_group, targets):
     '''
     Create a environment packages snapshot to requirements.txt file. E.g.\n
     pd freeze
     '''
+    from podao.main import Project
+    from podao.util import check_pyvenv
+
+    if all:
+        group = ALL_GROUP_NAME
+    if dev:
+        group = 'dev'
+
+    if workspace:
+        if each_group:
+            run_workspace(workspace, jobs, 'freeze_each', hashes, targets)
+        else:
+            run_workspace(workspace, jobs, 'freeze', group, hashes, targets)
+        return
+
     if root := check_pyvenv():
         click.secho(f'Working on {root}')
     else:
@@ -157,17 +274,234 @@ def freeze(dev, group, all):
             err=True,
         )
 
+    try:
+        pro = Project(root)
+        if each_group:
+            messages = pro.freeze_each(hashes, targets)
+        else:
+            messages = pro.freeze(group, hashes, targets)
+        for s in messages:
+            click.secho(s)
+
+    except Exception as e:
+        click.secho(e, fg='red', err=True)
+    else:
+        click.secho('Done!')
+
+
+@pd.command
+@click.option(
+    '--dev', '-d', is_flag=True, default=False, help='Sync with the dev packages snapshot'
+)
+@click.option(
+    '--all', '-a', is_flag=True, default=False, help='Sync with the all packages snapshot'
+)
+@click.option(
+    '--group',
+    '-g',
+    prompt=True,
+    prompt_required=False,
+    default='',
+    help='Sync with a group packages snapshot default `main`',
+)
+@click.option(
+    '--workspace',
+    '-w',
+    type=click.Path(exists=True, file_okay=False),
+    help='Sync every project environment under a workspace root.',
+)
+@click.option(
+    '--jobs', '-j', type=int, default=None, help='Maximum projects processed at once.'
+)
+@click.option(
+    '--store',
+    is_flag=True,
+    default=False,
+    envvar='PODAO_STORE',
+    help='Link packages from the shared wheel store instead of unpacking them.',
+)
+@click.option(
+    '--offline',
+    is_flag=True,
+    default=False,
+    envvar='PODAO_OFFLINE',
+    help='Install from the local wheelhouse only, see `pd fetch`.',
+)
+def sync(dev, group, all, workspace, jobs, store, offline):
+    '''
+    Install and remove packages to match the requirements.txt snapshot. E.g.\n
+    pd sync
+    '''
+    from podao.main import Project
+    from podao.util import check_pyvenv
+
     if all:
         group = ALL_GROUP_NAME
     if dev:
         group = 'dev'
 
+    if workspace:
+        run_workspace(workspace, jobs, 'sync', group, store=store, offline=offline)
+        return
+
+    if root := check_pyvenv():
+        click.secho(f'Working on {root}')
+    else:
+        click.secho(
+            'Warning: Cannot find virtual environment, init it firstly using `pd init dir [python version]`',
+            fg='red',
+            err=True,
+        )
+
+    try:
+        pro = Project(root, store=store, offline=offline)
+        for s in pro.sync(group):
+            click.secho(s)
+
+    except Exception as e:
+        click.secho(e, fg='red', err=True)
+    else:
+        click.secho('Done!')
+
+
+@pd.command
+@click.option(
+    '--dev', '-d', is_flag=True, default=False, help='Fetch the dev packages snapshot'
+)
+@click.option(
+    '--all', '-a', is_flag=True, default=False, help='Fetch the all packages snapshot'
+)
+@click.option(
+    '--group',
+    '-g',
+    prompt=True,
+    prompt_required=False,
+    default='',
+    help='Fetch a group packages snapshot default `main`',
+)
+def fetch(dev, group, all):
+    '''
+    Download the requirements.txt snapshot packages into the local wheelhouse
+    for every target in [tool.podao] of pyproject.toml. E.g.\n
+    pd fetch
+    '''
+    from podao.main import Project
+    from podao.util import check_pyvenv
+
+    if all:
+        group = ALL_GROUP_NAME
+    if dev:
+        group = 'dev'
+
+    if root := check_pyvenv():
+        click.secho(f'Working on {root}')
+    else:
+        click.secho(
+            'Warning: Cannot find virtual environment, init it firstly using `pd init dir [python version]`',
+            fg='red',
+            err=True,
+        )
+
     try:
         pro = Project(root)
-        for s in pro.freeze(group):
+        for s in pro.fetch(group):
             click.secho(s)
 
     except Exception as e:
         click.secho(e, fg='red', err=True)
     else:
         click.secho('Done!')
+
+
+@pd.command
+@click.argument('package', nargs=1, required=False)
+@click.option(
+    '--dev', '-d', is_flag=True, default=False, help='Show the dev packages tree'
+)
+@click.option(
+    '--all', '-a', is_flag=True, default=False, help='Show the all packages tree'
+)
+@click.option(
+    '--group',
+    '-g',
+    prompt=True,
+    prompt_required=False,
+    default='',
+    help='Show a group packages tree default `main`',
+)
+def tree(package, dev, group, all):
+    '''
+    Show the dependency tree of the declared packages or of a package. E.g.\n
+    pd tree requests
+    '''
+    from podao.main import Project
+    from podao.util import check_pyvenv
+
+    if all:
+        group = ALL_GROUP_NAME
+    if dev:
+        group = 'dev'
+
+    if not (root := check_pyvenv()):
+        click.secho(
+            'Warning: Cannot find virtual environment, init it firstly using `pd init dir [python version]`',
+            fg='red',
+            err=True,
+        )
+        return
+
+    try:
+        pro = Project(root)
+        for s in pro.tree(group, package):
+            click.secho(s)
+    except Exception as e:
+        click.secho(e, fg='red', err=True)
+
+
+@pd.command
+@click.argument('package', nargs=1)
+def why(package):
+    '''
+    Show which packages and dependency groups need a package. E.g.\n
+    pd why idna
+    '''
+    from podao.main import Project
+    from podao.util import check_pyvenv
+
+    if not (root := check_pyvenv()):
+        click.secho(
+            'Warning: Cannot find virtual environment, init it firstly using `pd init dir [python version]`',
+            fg='red',
+            err=True,
+        )
+        return
+
+    try:
+        pro = Project(root)
+        for s in pro.why(package):
+            click.secho(s)
+    except Exception as e:
+        click.secho(e, fg='red', err=True)
+
+
+def run_workspace(root, jobs, action, *args, **options):
+    from podao.main import Workspace
+
+    ws = Workspace(root, jobs, **options)
+    click.secho(f'Working on {len(ws.projects)} projects under {ws.root}')
+
+    failed = 0
+    for dir, messages, error in ws.run(action, *args):
+        name = os.path.relpath(dir, ws.root)
+        if error:
+            failed += 1
+            click.secho(f'{name}: {error}', fg='red', err=True)
+        else:
+            click.secho(f'{name}: ok', fg='green')
+            for s in messages:
+                click.secho(f'    {s}')
+
+    click.secho(
+        f'Done! {len(ws.projects) - failed} succeeded, {failed} failed',
+        fg='red' if failed else None,
+    )
@@ -1,6 +1,10 @@
 SRC_DIR = 'src'
 TEST_DIR = 'test'
 VSCODE_DIR = '.vscode'
+PODAO_DIR = '.podao'
+WHEELHOUSE_DIR = 'wheelhouse'
+CACHE_DIR = 'podao'
+STORE_DIR = 'store'
 
 README_FILE = 'README.md'
 LICENSE_FILE = 'LICENSE'
@@ -8,13 +12,69 @@ GITIGNORE_FILE = '.gitignore'
 PYPROJECT_FILE = 'pyproject.toml'
 REQUIREMENTS_FILE = 'requirements{group}.txt'
 VSCODE_FILE = 'settings.json'
+FREEZE_STATE_FILE = 'freeze.json'
+INDEX_FILE = 'index.json'
 
 ALL_GROUP_NAME = 'all'
+SEED_PACKAGES = ('pip', 'setuptools', 'wheel')
 
-EXTRA_REGEX = r'(.*)?extra == "(.*?)"'
 VERSION_REGEX = r'^(\s*)(\d+).(\d+)(?:.(\d+))?$'
 REQUIRES_PYTHON_REGEX = r'^(\d+.\d+)?(?:.\d)?$'
 
+PREBUILT_PATTERNS = (
+    'python-{version}.tar.*',
+    'python-{version}-*.tar.*',
+    'cpython-{version}+*.tar.*',
+    'cpython-{version}-*.tar.*',
+)
+
+# Marker values of a target, keyed on the platform tag prefix.
+PLATFORM_MARKERS = {
+    'manylinux': ('linux', 'Linux', 'posix'),
+    'musllinux': ('linux', 'Linux', 'posix'),
+    'linux': ('linux', 'Linux', 'posix'),
+    'macosx': ('darwin', 'Darwin', 'posix'),
+    'win': ('win32', 'Windows', 'nt'),
+}
+WINDOWS_MACHINES = {'win32': 'x86', 'win_amd64': 'AMD64', 'win_arm64': 'ARM64'}
+IMPLEMENTATIONS = {'cp': 'CPython', 'pp': 'PyPy', 'ip': 'IronPython', 'jy': 'Jython'}
+
+
+MARKER_ENV_SCRIPT = '''\
+import json, os, platform, sys
+
+def fmt(info):
+    version = '{0.major}.{0.minor}.{0.micro}'.format(info)
+    if info.releaselevel != 'final':
+        version += info.releaselevel[0] + str(info.serial)
+    return version
+
+print(json.dumps({
+    'implementation_name': sys.implementation.name,
+    'implementation_version': fmt(sys.implementation.version),
+    'os_name': os.name,
+    'platform_machine': platform.machine(),
+    'platform_release': platform.release(),
+    'platform_system': platform.system(),
+    'platform_version': platform.version(),
+    'python_full_version': platform.python_version(),
+    'platform_python_implementation': platform.python_implementation(),
+    'python_version': '.'.join(platform.python_version_tuple()[:2]),
+    'sys_platform': sys.platform,
+}))
+'''
+
+
+SCRIPT_TPL = '''\
+#!{python}
+import sys
+
+from {module} import {head}
+
+if __name__ == '__main__':
+    sys.exit({attr}())
+'''
+
 
 README_TPL = '''\
 # Example Package
@@ -52,6 +112,8 @@ SOFTWARE.
 
 GITIGNORE_TPL = '''\
 __pycache__
+.podao
+wheelhouse
 *.log
 *.gz
 *.egg-info
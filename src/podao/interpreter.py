@@ -0,0 +1,148 @@
+import glob
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+
+from functools import cache
+
+import sh
+
+from packaging.specifiers import SpecifierSet
+from packaging.version import Version
+
+from podao.constant import PREBUILT_PATTERNS, VERSION_REGEX
+from podao.profile import phase
+from podao.util import available_pythons, disk_cache, mtimes, pyenv_root
+
+
+def pyenv_versions():
+    dir = os.path.join(pyenv_root(), 'versions')
+    if not os.path.isdir(dir):
+        return []
+    return [v for v in os.listdir(dir) if re.match(VERSION_REGEX, v)]
+
+
+@cache
+def _version_index(versions):
+    return sorted((Version(v), v) for v in versions)
+
+
+def version_index(installed=False):
+    return _version_index(tuple(pyenv_versions() if installed else available_pythons()))
+
+
+@phase
+def select_python(python=None, requires_python=None):
+    '''
+    Pick the python version to build the project with: `python` itself when
+    it is an exact version, otherwise the newest installed pyenv version that
+    satisfies `requires-python` and the `python` prefix, falling back to the
+    newest installable one.
+    '''
+    if python and python in pyenv_versions():
+        return python
+
+    installable = version_index()
+    if python and python in [s for _, s in installable]:
+        return python
+
+    spec = SpecifierSet(requires_python or '')
+    if python and re.match(r'^\d+\.\d+$', python):
+        spec &= SpecifierSet(f'=={python}.*')
+
+    for versions in (version_index(installed=True), installable):
+        if matched := [s for v, s in versions if v in spec]:
+            return matched[-1]
+    return None
+
+
+def pyenv_python(version):
+    return os.path.join(pyenv_root(), 'versions', version, 'bin', 'python')
+
+
+def python_version(exe):
+    return disk_cache(
+        f'python-version:{exe}',
+        mtimes(exe),
+        lambda: str(
+            sh.Command(exe)('-c', 'import platform; print(platform.python_version())')
+        ).strip(),
+    )
+
+
+def system_pythons():
+    '''
+    Yield (version, path) of the python3 interpreters on PATH which are not
+    managed by pyenv.
+    '''
+    seen = set()
+    root = os.path.realpath(pyenv_root())
+    for dir in os.environ.get('PATH', '').split(os.pathsep):
+        if not dir or os.path.realpath(dir).startswith(root):
+            continue
+        for exe in sorted(glob.glob(os.path.join(dir, 'python3*'))):
+            if not re.search(r'python3(\.\d+)?$', exe) or not os.access(exe, os.X_OK):
+                continue
+            if (real := os.path.realpath(exe)) in seen:
+                continue
+            seen.add(real)
+            try:
+                yield python_version(real), real
+            except (sh.ErrorReturnCode, sh.CommandNotFound, OSError):
+                continue
+
+
+def find_prebuilt(version, dir):
+    for pattern in PREBUILT_PATTERNS:
+        if paths := sorted(glob.glob(os.path.join(dir, pattern.format(version=version)))):
+            return paths[-1]
+    return None
+
+
+@phase
+def unpack_prebuilt(tarball, version):
+    '''
+    Unpack a prebuilt interpreter tarball as a pyenv version, the archive
+    may keep the install prefix at any depth, e.g. `python/install/bin`.
+    '''
+    dest = os.path.join(pyenv_root(), 'versions', version)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(dest)) as tmp:
+        with tarfile.open(tarball) as t:
+            if hasattr(tarfile, 'data_filter'):
+                t.extractall(tmp, filter='data')
+            else:
+                t.extractall(tmp)
+
+        for dir, dirs, files in os.walk(tmp):
+            if os.path.basename(dir) == 'bin' and 'python3' in files:
+                prefix = os.path.dirname(dir)
+                break
+        else:
+            raise Exception(f'Can not find bin/python3 in {tarball}')
+
+        python = os.path.join(prefix, 'bin', 'python')
+        if not os.path.exists(python):
+            os.symlink('python3', python)
+        shutil.move(prefix, dest)
+    return pyenv_python(version)
+
+
+@phase
+def find_interpreter(version, prebuilt_dir=None):
+    '''
+    Return (source, path) of an interpreter for `version` that needs no
+    compiling, source is one of `pyenv`, `system` or `prebuilt`.
+    '''
+    if version in pyenv_versions():
+        return 'pyenv', pyenv_python(version)
+
+    for v, exe in system_pythons():
+        if v == version:
+            return 'system', exe
+
+    if prebuilt_dir and (tarball := find_prebuilt(version, prebuilt_dir)):
+        return 'prebuilt', tarball
+
+    return None, None
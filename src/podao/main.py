@@ -1,47 +1,103 @@
 import getpass
+import hashlib
+import json
 import os
 import re
+import sys
+import tempfile
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from importlib.metadata import requires
+from functools import lru_cache
 
 import sh
 import tomlkit
 
 from packaging.requirements import Requirement
+from packaging.utils import canonicalize_name
+from packaging.version import Version
 
 from podao.constant import (
-    EXTRA_REGEX,
+    ALL_GROUP_NAME,
+    FREEZE_STATE_FILE,
     GITIGNORE_FILE,
     GITIGNORE_TPL,
+    INDEX_FILE,
     LICENSE_FILE,
     LICENSE_TPL,
+    PODAO_DIR,
     PYPROJECT_FILE,
     PYPROJECT_TPL,
     README_FILE,
     README_TPL,
     REQUIREMENTS_FILE,
     REQUIRES_PYTHON_REGEX,
+    SEED_PACKAGES,
     SRC_DIR,
     TEST_DIR,
-    VERSION_REGEX,
     VSCODE_DIR,
     VSCODE_FILE,
     VSCODE_TPL,
+    WHEELHOUSE_DIR,
+)
+from podao.interpreter import (
+    find_interpreter,
+    pyenv_python,
+    select_python,
+    unpack_prebuilt,
+)
+from podao.metadata import (
+    DependencyGraph,
+    DependencyIndex,
+    editable_dists,
+    load_dists,
+    marker_env,
+    node_names,
+    parse_dist_filename,
+    scan_wheelhouse,
+    site_packages,
+    split_node,
+    target_dists,
+    target_env,
+    target_tags,
+)
+from podao.profile import phase
+from podao.store import WheelStore
+from podao.util import (
+    atomic_write,
+    create_dir,
+    file_hash,
+    file_lock,
+    find_projects,
+    mtimes,
+    stream,
+    toml_array,
+    toml_string,
 )
-from podao.util import atomic_write, create_dir, singleton
 
 
-@singleton
 class Project:
-    def __init__(self, dir):
+    def __init__(self, dir, store=False, offline=False):
         self.root = self._ensure_root(dir)
+        self.store = store
+        self.offline = offline
         self.config = self._ensure_config()
+        self.depends = self._index_depends(self.config)
+        self._changes = []
 
     @property
     def pip(self):
-        sh.cd(self.root)
-        return sh.Command('./bin/pip')
+        pip = sh.Command(os.path.join(self.root, 'bin', 'pip'))
+        if self.offline:
+            env = {**os.environ, 'PIP_NO_INDEX': '1', 'PIP_FIND_LINKS': self.wheelhouse}
+            return pip.bake(_cwd=self.root, _env=env)
+        return pip.bake(_cwd=self.root)
+
+    @property
+    def wheelhouse(self):
+        dir = self.get_tool_config().get('wheelhouse', WHEELHOUSE_DIR)
+        return os.path.join(self.root, dir)
 
     def _ensure_root(self, dir):
         dir = os.path.normpath(os.path.abspath(dir or '.'))
@@ -61,18 +117,21 @@ class Project:
             config.get('build-system', None) and isinstance(config['build-system'], dict)
         ):
             config['build-system'] = tomlkit.table()
-            config['build-system']['requires'] = ['setuptools']
-            config['build-system']['build-backend'] = 'setuptools.build_meta'
+            config['build-system']['requires'] = toml_array(['setuptools'])
+            config['build-system']['build-backend'] = toml_string('setuptools.build_meta')
 
         if not (config.get('project', None) and isinstance(config['project'], dict)):
             config['project'] = tomlkit.table()
 
         if not config['project'].get('name', None):
-            config['project']['name'] = os.path.basename(self.root)
+            config['project']['name'] = toml_string(os.path.basename(self.root))
 
         if not config['project'].get('authors', None):
-            config['project']['authors'] = []
-            config['project']['authors'].append({'name': getpass.getuser(), 'email': ''})
+            author = tomlkit.inline_table()
+            author['name'] = toml_string(getpass.getuser())
+            author['email'] = toml_string('')
+            config['project']['authors'] = tomlkit.array()
+            config['project']['authors'].append(author)
 
         if not (
             config['project'].get('optional-dependencies', None)
@@ -82,15 +141,92 @@ class Project:
 
         return config
 
-    def _purify_depends(self, package, group=None, purge=False):
-        depends = {Package(p) for p in self.get_dependencies(group)}
-        package = {Package(package)}
-        depends = (depends - package) if purge else ((depends - package) | package)
+    def _lock(self, name):
+        return file_lock(os.path.join(self.root, PODAO_DIR, f'{name}.lock'))
+
+    def _index_depends(self, config):
+        project = config.get('project', {})
+        groups = {'': project.get('dependencies', [])}
+        groups.update(project.get('optional-dependencies', {}))
+
+        depends = {}
+        for g, lines in groups.items():
+            depends[g] = {}
+            for line in lines:
+                p = Package(line)
+                depends[g][p.key] = p
         return depends
 
-    def _gen_pyproject(self):
-        with atomic_write(os.path.join(self.root, PYPROJECT_FILE), overwrite=True) as p:
-            p.write(tomlkit.dumps(self.config).replace('"', '\''))
+    def _set_depends(self, table, key, group, dynamic=False):
+        lines = [p.line_name for p in self.depends[group].values()]
+        old = table.get(key)
+        if old is None and not lines:
+            return
+        if old is not None and [Package(line).line_name for line in old] == lines:
+            return
+        if dynamic:
+            raise Exception(
+                f'Can not write {key} to {PYPROJECT_FILE}, it is listed in project.dynamic'
+            )
+        table[key] = toml_array(lines, old is not None and '\n' in old.as_string())
+
+    def _flush_depends(self, config):
+        if 'project' not in config:
+            if not any(self.depends.values()):
+                return
+            config['project'] = tomlkit.table()
+            config['project']['name'] = toml_string(os.path.basename(self.root))
+        project = config['project']
+        dynamic = project.get('dynamic', [])
+        self._set_depends(project, 'dependencies', '', 'dependencies' in dynamic)
+
+        groups = self.get_optional_groups()
+        if created := 'optional-dependencies' not in project:
+            if not groups:
+                return
+            project['optional-dependencies'] = tomlkit.table()
+        optional = project['optional-dependencies']
+        for g in list(optional):
+            if g not in self.depends:
+                del optional[g]
+        for g in groups:
+            self._set_depends(optional, g, g, 'optional-dependencies' in dynamic)
+        if created:
+            optional.add(tomlkit.nl())
+
+    @phase
+    def _gen_pyproject(self, defaults=False):
+        '''
+        Write the dependency tables back to pyproject.toml. Unless `defaults`
+        is set, the file on disk is the base so everything outside of the
+        dependency tables is kept as it is, and nothing is written when the
+        tables did not change.
+        '''
+        path = os.path.join(self.root, PYPROJECT_FILE)
+        with self._lock('pyproject'):
+            original = None
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    original = f.read()
+
+            if defaults or original is None:
+                config = self.config
+            else:
+                # Another pd process may have changed the file since it was
+                # loaded, replay our changes on top of what is on disk now.
+                config = tomlkit.parse(original)
+                self.depends = self._index_depends(config)
+                for change in self._changes:
+                    self._apply(*change)
+                self._flush_depends(config)
+            self._flush_depends(self.config)
+            self._changes.clear()
+
+            if (data := tomlkit.dumps(config)) == original:
+                yield f'    {PYPROJECT_FILE} unchanged'
+                return
+            with atomic_write(path) as p:
+                p.write(data)
         yield f'    {PYPROJECT_FILE} refreshed'
 
     def _gen_readme(self):
@@ -130,156 +266,709 @@ class Project:
             p.write(VSCODE_TPL)
         yield f'    {VSCODE_FILE} created'
 
+    @phase
     def _gen_requirements(self, data, req_file):
-        with atomic_write(os.path.join(self.root, req_file)) as p:
-            p.write(data)
-
-    def create_venv(self, python):
-        available_python = [
-            v.strip()
-            for v in sh.pyenv('install', '--list').splitlines()
-            if re.match(VERSION_REGEX, v)
+        path = os.path.join(self.root, req_file)
+        with self._lock('requirements'):
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    if f.read() == data:
+                        yield f'    {req_file} unchanged'
+                        return
+            with atomic_write(path) as p:
+                p.write(data)
+        yield f'    {req_file} refreshed'
+
+    def _freeze_digest(self, groups, hashes, target=None):
+        '''
+        Digest of everything a snapshot is computed from: the dependency
+        tables of `groups`, the installed distributions, the options and for
+        a target, the target and the wheelhouse.
+        '''
+        data = {
+            'depends': {
+                g: sorted(p.line_name for p in self.get_dependencies(g)) for g in groups
+            },
+            'dists': self._dist_names(),
+            'hashes': hashes,
+            'target': target,
+            'wheelhouse': mtimes(self.wheelhouse) if target else None,
+        }
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def _dist_names(self):
+        # Installing, upgrading or removing a package renames its dist-info,
+        # unlike mtimes the names do not change when nothing was installed.
+        if not (path := site_packages(self.root)):
+            return []
+        return [path] + sorted(n for n in os.listdir(path) if n.endswith('.dist-info'))
+
+    def _frozen(self, req_file, digest):
+        # The snapshot itself may have been edited or removed since.
+        path = os.path.join(self.root, req_file)
+        state = self._read_state(FREEZE_STATE_FILE).get(req_file, {})
+        return (
+            state.get('digest') == digest
+            and os.path.exists(path)
+            and state.get('output') == file_hash(path)
+        )
+
+    def _read_state(self, name):
+        try:
+            with open(os.path.join(self.root, PODAO_DIR, name), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_state(self, name, key, value):
+        with self._lock('state'):
+            state = self._read_state(name)
+            state[key] = value
+            with atomic_write(os.path.join(self.root, PODAO_DIR, name)) as f:
+                json.dump(state, f, indent=2, sort_keys=True)
+
+    def _req_file(self, group=None, target=None):
+        suffix = ('-' + group if group else '') + ('-' + target['name'] if target else '')
+        return REQUIREMENTS_FILE.format(group=suffix)
+
+    def _read_requirements(self, req_file):
+        locked = {}
+        with open(os.path.join(self.root, req_file)) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith(('#', '-')):
+                    continue
+                req = Requirement(line.split(' --')[0])
+                locked[canonicalize_name(req.name)] = (req.specifier, line)
+        return locked
+
+    @phase
+    def _hash_lines(self, lines):
+        with tempfile.TemporaryDirectory() as dir:
+            req_file = os.path.join(dir, 'requirements.txt')
+            with open(req_file, 'w') as f:
+                f.write('\n'.join(lines))
+            self.pip('download', '--no-deps', '-q', '-d', dir, '-r', req_file)
+
+            hashes = {}
+            for filename in sorted(os.listdir(dir)):
+                if parsed := parse_dist_filename(filename):
+                    hashes.setdefault(parsed[0], []).append(
+                        file_hash(os.path.join(dir, filename))
+                    )
+
+        return [
+            ' '.join(
+                [line] + [f'--hash=sha256:{h}' for h in hashes.get(Package(line).key, [])]
+            )
+            for line in lines
         ]
-        if not python or python not in available_python:
-            python = available_python[-1]
 
-        if not python:
+    def _wheelhouse_hash_lines(self, lines, target):
+        # pip requires a hash on every line once one has it, the lines are
+        # returned as they are if any of them has no wheel to hash.
+        env = target_env(marker_env(self.root), target)
+        tags = target_tags(target, env)
+        files = scan_wheelhouse(self.wheelhouse)
+
+        hashed, missing = [], []
+        for line in lines:
+            name, version = line.split('==')
+            hashes = [
+                file_hash(os.path.join(self.wheelhouse, filename))
+                for v, filename, t in files.get(canonicalize_name(name), [])
+                if v == Version(version) and (t is None or t & tags)
+            ]
+            if not hashes:
+                missing.append(line)
+            hashed.append(' '.join([line] + [f'--hash=sha256:{h}' for h in hashes]))
+        return (list(lines) if missing else hashed), missing
+
+    @phase
+    def _prefetch(self):
+        lines = [p.line_name for g in self.depends.values() for p in g.values()]
+        if not lines or self.offline:
+            return
+
+        yield f'Prefetching {len(lines)} declared dependencies'
+        with tempfile.TemporaryDirectory() as dir:
+            try:
+                yield from stream(
+                    sh.Command(self.interpreter),
+                    *('-m', 'pip', 'download', '-q', '-d', dir, *lines),
+                    _cwd=self.root,
+                )
+            except sh.ErrorReturnCode:
+                yield '    Prefetching failed, packages will be downloaded on install'
+                return
+
+            if self.store:
+                store = WheelStore()
+                for filename in os.listdir(dir):
+                    if filename.endswith('.whl'):
+                        store.add(os.path.join(dir, filename))
+
+    @phase
+    def init(self, python, ide, prebuilt=None):
+        # The scaffold does not depend on the interpreter, build it meanwhile.
+        with ThreadPoolExecutor(1) as pool:
+            structure = pool.submit(list, self.create_structure(ide, pyproject=False))
+            yield from self.create_venv(python, prefetch=True, prebuilt=prebuilt)
+            yield from structure.result()
+        yield from self._gen_pyproject(defaults=True)
+
+    @phase
+    def create_venv(self, python, prefetch=False, prebuilt=None):
+        requires_python = self.config['project'].get('requires-python')
+        if not (python := select_python(python, requires_python)):
             yield 'Can not find available python, specify a python version number please'
+            return
         self.python = python
 
         yield f'Working on {self.root}'
         yield f'Preparing project environment with python {python}'
-        sh.pyenv('install', '-s', python)
-        sh.pyenv('local', python)
-        sh.python('-m', 'venv', '.')
-        self.config['project'][
-            'requires-python'
-        ] = f'>={re.match(REQUIRES_PYTHON_REGEX, self.python)[1]}'
-
-    def create_structure(self, ide):
+        source, path = find_interpreter(python, prebuilt)
+        if source == 'pyenv':
+            yield f'Using installed pyenv python {path}'
+        elif source == 'system':
+            yield f'Using system python {path}'
+        elif source == 'prebuilt':
+            yield f'Unpacking prebuilt python {path}'
+            start = time.perf_counter()
+            path = unpack_prebuilt(path, python)
+            yield f'    Done in {time.perf_counter() - start:.1f}s'
+        elif self.offline:
+            raise Exception(f'Can not find installed or prebuilt python {python} offline')
+        else:
+            yield f'Building python {python} from source'
+            yield from stream(sh.pyenv, 'install', '-s', python, _cwd=self.root)
+            path = pyenv_python(python)
+        self.interpreter = path
+
+        if source != 'system':
+            yield f'Setting local python {python}'
+            yield from stream(sh.pyenv, 'local', python, _cwd=self.root)
+        yield 'Creating virtual environment'
+        with ThreadPoolExecutor(1) as pool:
+            fetching = pool.submit(list, self._prefetch()) if prefetch else None
+            yield from stream(sh.Command(path), '-m', 'venv', '.', _cwd=self.root)
+            if fetching:
+                yield from fetching.result()
+        if not requires_python:
+            self.config['project']['requires-python'] = toml_string(
+                f'>={re.match(REQUIRES_PYTHON_REGEX, self.python)[1]}'
+            )
+
+    @phase
+    def create_structure(self, ide, pyproject=True):
         yield f'Preparing project directories: {SRC_DIR} {TEST_DIR}'
         yield from create_dir(self.root, SRC_DIR)
         yield from create_dir(self.root, TEST_DIR)
 
         yield f'Preparing project files: {PYPROJECT_FILE} {README_FILE} {LICENSE_FILE} {GITIGNORE_FILE}'
-        yield from self._gen_pyproject()
+        if pyproject:
+            yield from self._gen_pyproject(defaults=True)
         yield from self._gen_readme()
         yield from self._gen_license()
         yield from self._gen_gitignore()
         if ide:
             yield from self._gen_vscode()
 
-    def install(self, packages, group=None):
-        for k in packages:
-            yield f'Installing {k}'
-            self.pip('install', '-U', k)
-            self.add_package(k, group)
-        yield from self._gen_pyproject()
+    def _pip_install(self, *args, upgrade=False):
+        if self.store:
+            yield from self._store_install(*args)
+        else:
+            yield from stream(self.pip, 'install', *(['-U'] if upgrade else []), *args)
+
+    @phase
+    def _store_install(self, *args):
+        store = WheelStore()
+        dists = load_dists(self.root)
+        with tempfile.TemporaryDirectory() as dir:
+            yield from stream(
+                self.pip,
+                'download',
+                '--prefer-binary',
+                '-f',
+                store.wheels,
+                '-d',
+                dir,
+                *args,
+            )
 
-    def uninstall(self, packages):
+            trees, stale, rest = [], [], []
+            for filename in sorted(os.listdir(dir)):
+                path = os.path.join(dir, filename)
+                name, version = parse_dist_filename(filename) or (None, None)
+                if name in dists and Version(dists[name].version) == version:
+                    continue
+                if filename.endswith('.whl') and store.linkable(tree := store.add(path)):
+                    trees.append(tree)
+                    if name in dists:
+                        stale.append(dists[name].name)
+                else:
+                    rest.append(path)
+
+            if stale:
+                yield from stream(self.pip, 'uninstall', '-y', *stale)
+            for tree in trees:
+                dist_info = store.link(
+                    tree, site_packages(self.root), os.path.join(self.root, 'bin')
+                )
+                yield f'    Linked {os.path.basename(dist_info)}'
+            if rest:
+                yield from stream(self.pip, 'install', '--no-deps', *rest)
+
+    def _pip_batch(self, packages, run):
+        try:
+            yield from run(*packages)
+            return list(packages), []
+        except sh.ErrorReturnCode:
+            if len(packages) == 1:
+                return [], list(packages)
+
+        # The resolver fails as a whole, retry one by one to find the culprits.
+        done, failed = [], []
         for k in packages:
-            yield f'Uninstalling {k}'
-            self.pip('uninstall', '-y', k)
-            self.del_package(k)
-        yield from self._gen_pyproject()
-
-    def freeze(self, group=None):
-        req_file = REQUIREMENTS_FILE.format(group="-" + group if group else "")
-        yield f'Creating snapshot to {req_file}'
-        self._gen_requirements(
-            '\n'.join(sorted([p.line_name for p in self.snap_packages(group)])), req_file
-        )
+            try:
+                yield from run(k)
+                done.append(k)
+            except sh.ErrorReturnCode:
+                failed.append(k)
+        return done, failed
+
+    @phase
+    def install(self, packages, group=None):
+        if not packages:
+            return
+        yield f'Installing {" ".join(packages)}'
+        with self._lock('venv'):
+            done, failed = yield from self._pip_batch(
+                packages, lambda *k: self._pip_install(*k, upgrade=True)
+            )
+        for k in done:
+            self.add_package(k, group)
+        for k in failed:
+            yield f'    Failed to install {k}'
+        if done:
+            yield from self._gen_pyproject()
+            self.dependency_index()
+        if failed:
+            raise Exception(f'Failed to install {" ".join(failed)}')
+
+    @phase
+    def uninstall(self, packages, prune=False):
+        if not packages:
+            return
+        yield f'Uninstalling {" ".join(packages)}'
+        with self._lock('venv'):
+            orphans = self._orphans(packages) if prune else []
+            if orphans:
+                yield f'Pruning {" ".join(orphans)}'
+            done, failed = yield from self._pip_batch(
+                list(packages) + orphans,
+                lambda *k: stream(self.pip, 'uninstall', '-y', *k),
+            )
+        for k in done:
+            if k in packages:
+                self.del_package(k)
+        for k in failed:
+            yield f'    Failed to uninstall {k}'
+        if done:
+            yield from self._gen_pyproject()
+            self.dependency_index()
+        if failed:
+            raise Exception(f'Failed to uninstall {" ".join(failed)}')
+
+    def _orphans(self, packages):
+        '''
+        Return the packages only needed by `packages`: everything below them
+        which neither another declared dependency nor another installed
+        package needs.
+        '''
+        index = self.dependency_index()
+        removed = {Package(k).key for k in packages}
+        below = index.closure(n for n in index.forward if split_node(n)[0] in removed)
+
+        roots = [n for n in index.dists if n not in below]
+        for key, (extras, _) in self._declared().items():
+            if key not in removed:
+                roots += node_names(key, extras)
+        keep = index.closure(roots) | set(SEED_PACKAGES) | removed
+        return sorted(index.dists[n].name for n in below - keep)
+
+    @phase
+    def freeze(self, group=None, hashes=False, targets=False):
+        yield from self._freeze([group], hashes, targets)
+
+    @phase
+    def freeze_each(self, hashes=False, targets=False):
+        '''
+        Snapshot the main dependencies, every optional group and all of them
+        from a single scan of the environment.
+        '''
+        groups = [None] + self.get_optional_groups()
+        if len(groups) > 1:
+            groups.append(ALL_GROUP_NAME)
+        yield from self._freeze(groups, hashes, targets)
+
+    def _freeze(self, groups, hashes, targets=False):
+        if not targets:
+            targets = [None]
+        elif not (targets := self.get_targets()):
+            raise Exception(f'No targets declared in [tool.podao] of {PYPROJECT_FILE}')
+
+        for target in targets:
+            pending = []
+            for group in groups:
+                req_file = self._req_file(group, target)
+                yield f'Creating snapshot to {req_file}'
+                digest = self._freeze_digest(self._snap_groups(group), hashes, target)
+                if self._frozen(req_file, digest):
+                    yield '    Snapshot is up to date'
+                else:
+                    pending.append((group, req_file, digest))
+            if not pending:
+                continue
+
+            snaps, notes = self.snap_groups([group for group, _, _ in pending], target)
+            for note in notes:
+                yield f'    Warning: {note}'
+            lines = {g: sorted(p.line_name for p in snap) for g, snap in snaps.items()}
+            if hashes:
+                yield 'Collecting package hashes'
+                union = sorted(set().union(*lines.values()))
+                if target:
+                    hashed, missing = self._wheelhouse_hash_lines(union, target)
+                    if missing:
+                        yield (
+                            f'    Warning: No hashes written, no wheel of '
+                            f'{" ".join(missing)} in the wheelhouse'
+                        )
+                    hashed = dict(zip(union, hashed))
+                else:
+                    hashed = dict(zip(union, self._hash_lines(union)))
+                lines = {g: [hashed[line] for line in ls] for g, ls in lines.items()}
+
+            for group, req_file, digest in pending:
+                yield from self._gen_requirements('\n'.join(lines[group]), req_file)
+                output = file_hash(os.path.join(self.root, req_file))
+                self._write_state(
+                    FREEZE_STATE_FILE, req_file, {'digest': digest, 'output': output}
+                )
+
+    @phase
+    def sync(self, group=None):
+        req_file = self._req_file(group)
+        yield f'Synchronizing environment with {req_file}'
+        with self._lock('venv'):
+            yield from self._sync(req_file)
+
+    def _sync(self, req_file):
+        locked = self._read_requirements(req_file)
+        dists = load_dists(self.root)
+
+        missing = [
+            line
+            for name, (specifier, line) in locked.items()
+            if name not in dists
+            or not specifier.contains(dists[name].version, prereleases=True)
+        ]
+        # Editable installs, the project itself included, are not in snapshots.
+        keep = locked.keys() | SEED_PACKAGES | editable_dists(self.root)
+        extra = [d.name for name, d in dists.items() if name not in keep]
+        if not (missing or extra):
+            yield '    Environment is up to date'
+            return
+
+        if extra:
+            yield f'Removing {" ".join(extra)}'
+            yield from stream(self.pip, 'uninstall', '-y', *extra)
+        if missing:
+            yield f'Installing {len(missing)} packages'
+            with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+                f.write('\n'.join(missing))
+                f.flush()
+                yield from self._pip_install('--no-deps', '-r', f.name)
+
+    @phase
+    def fetch(self, group=None):
+        req_file = self._req_file(group)
+        for target in self.get_targets() or [{}]:
+            args = []
+            if python := target.get('python'):
+                args += ['--python-version', python]
+            for platform in target.get('platforms', []):
+                args += ['--platform', platform]
+            if implementation := target.get('implementation'):
+                args += ['--implementation', implementation]
+            name = ' '.join(args[1::2]) or 'current environment'
+            if args:
+                args += ['--only-binary', ':all:']
+
+            yield f'Fetching {req_file} for {name}'
+            yield from stream(
+                self.pip, 'download', '-d', self.wheelhouse, '-r', req_file, *args
+            )
 
+    @phase
     def snap_packages(self, group=None):
-        packages = {
-            Package(p)
-            for p in self.pip('freeze').splitlines()
-            if not (p.startswith('#') or p.startswith('-e'))
-        }
+        return self.snap_groups([group])[0][group]
+
+    @phase
+    def snap_groups(self, groups, target=None):
+        '''
+        Return ({group: packages}, notes) for each of `groups`, all of them
+        share one scan and one dependency graph, every dependency group is
+        resolved once since the closure of a union is the union of the
+        closures. A `target` is resolved from the installed metadata and the
+        wheelhouse with its own markers, no environment is built for it.
+        '''
+        dists = load_dists(self.root)
+        env = marker_env(self.root)
+        notes = []
+        if target:
+            env = target_env(env, target)
+            dists, notes = target_dists(
+                dists,
+                scan_wheelhouse(self.wheelhouse),
+                self.wheelhouse,
+                target_tags(target, env),
+            )
+        graph = DependencyGraph(dists, env)
+
+        closures = {}
+        for g in {g for group in groups for g in self._snap_groups(group)}:
+            # Declared markers count too, a root may not apply to the target.
+            roots = [
+                d
+                for d in self.get_dependencies(g)
+                if not d.marker or d.marker.evaluate({**graph.env, 'extra': ''})
+            ]
+            seen = graph.walk((d.name, d.extras) for d in roots)
+            if target:
+                notes += [
+                    f'{n} is neither installed nor in the wheelhouse'
+                    for n in sorted(seen - dists.keys())
+                ]
+            closures[g] = seen & dists.keys()
+
+        packages = {}
+        snaps = {}
+        for group in groups:
+            names = set().union(*(closures[g] for g in self._snap_groups(group)))
+            for n in names - packages.keys():
+                packages[n] = Package(f'{dists[n].name}=={dists[n].version}')
+            snaps[group] = {packages[n] for n in names}
+        return snaps, list(dict.fromkeys(notes))
+
+    def _snap_groups(self, group=None):
+        if group == ALL_GROUP_NAME:
+            return [''] + self.get_optional_groups()
+        return [''] + ([group] if group else [])
+
+    @phase
+    def dependency_index(self):
+        '''
+        Load the dependency index of the environment from .podao and bring it
+        up to date with the installed distributions.
+        '''
+        with self._lock('index'):
+            index = DependencyIndex(self._read_state(INDEX_FILE))
+            roots = [
+                n for k, (e, _) in self._declared().items() for n in node_names(k, e)
+            ]
+            if index.update(self.root, roots):
+                with atomic_write(os.path.join(self.root, PODAO_DIR, INDEX_FILE)) as f:
+                    json.dump(index.to_json(), f)
+        return index
+
+    def _declared(self):
+        # {name: (extras, groups)} of the dependencies declared in pyproject.
+        declared = {}
+        for g, packages in self.depends.items():
+            for key, p in packages.items():
+                extras, groups = declared.setdefault(key, (set(), []))
+                extras.update(p.extras)
+                groups.append(g or 'dependencies')
+        return declared
+
+    def _label(self, index, name, extras=()):
+        if not (dist := index.dists.get(name)):
+            return f'{name} (not installed)'
+        extras = f'[{",".join(sorted(extras))}]' if extras else ''
+        return f'{dist.name}{extras}=={dist.version}'
+
+    @phase
+    def tree(self, group=None, package=None):
+        index = self.dependency_index()
+        if package:
+            p = Package(package)
+            roots = {p.key: p.extras}
+        else:
+            roots = {}
+            for g in self._snap_groups(group):
+                for p in self.get_dependencies(g):
+                    roots.setdefault(p.key, set()).update(p.extras)
+
+        expanded = set()
+        for name in sorted(roots):
+            yield from self._tree_lines(index, name, roots[name], expanded)
+
+    def _tree_lines(self, index, name, extras, expanded, path=()):
+        indent = '    ' * len(path)
+        label = self._label(index, name, extras)
+        if name in path:
+            yield f'{indent}{label} (cycle)'
+            return
+        children = index.children(name, extras)
+        if name in expanded and children:
+            yield f'{indent}{label} (*)'
+            return
+        yield f'{indent}{label}'
+        expanded.add(name)
+        for dep in sorted(children):
+            yield from self._tree_lines(
+                index, dep, children[dep], expanded, path + (name,)
+            )
 
-        depends = {Package(p) for p in self.get_dependencies()}
-        if group == 'all':
-            for g in self.get_optional_groups():
-                depends |= {Package(p) for p in self.get_dependencies(g)}
-        elif group:
-            depends |= {Package(p) for p in self.get_dependencies(group)}
-
-        requirements = set()
-        for d in depends:
-            if d.extras:
-                requirements |= {
-                    Package(p)
-                    for p in requires(d.name)
-                    if (x := re.match(EXTRA_REGEX, str(Package(p).marker)))
-                    and x[2] in d.extras
-                }
+    @phase
+    def why(self, package):
+        index = self.dependency_index()
+        name = Package(package).key
+        if name not in index.dists:
+            raise Exception(f'{package} is not installed')
+        yield from self._why_lines(index, self._declared(), name, set())
+
+    def _why_lines(self, index, declared, name, expanded, path=()):
+        indent = '    ' * len(path)
+        label = self._label(index, name)
+        if name in declared:
+            label += f' ({", ".join(declared[name][1])})'
+        parents = index.reverse.get(name, [])
+        if name in path:
+            yield f'{indent}{label} (cycle)'
+            return
+        if not (parents or name in declared):
+            yield f'{indent}{label} (not required)'
+            return
+        if name in expanded and parents:
+            yield f'{indent}{label} (*)'
+            return
+        yield f'{indent}{label}'
+        expanded.add(name)
+        for parent in parents:
+            yield from self._why_lines(index, declared, parent, expanded, path + (name,))
+
+    def _apply(self, action, package, group=None):
+        if action == 'add':
+            if group:
+                self.depends.setdefault(group, {})[package.key] = package
             else:
-                requirements |= {
-                    Package(p)
-                    for p in requires(d.name)
-                    if not re.match(EXTRA_REGEX, str(Package(p).marker))
-                }
-
-        depends |= requirements
-        packages &= depends
-        return packages
+                for g in self.get_optional_groups():
+                    self.depends[g].pop(package.key, None)
+                self.depends[''][package.key] = package
+        else:
+            for g in list(self.depends):
+                if self.depends[g].pop(package.key, None) and g and not self.depends[g]:
+                    del self.depends[g]
 
     def add_package(self, package, group=None):
-        depends = self._purify_depends(package, group)
-        if group:
-            self.config['project']['optional-dependencies'][group] = [
-                p.line_name for p in depends
-            ]
-        else:
-            for g in self.get_optional_groups():
-                self.config['project']['optional-dependencies'][g] = [
-                    p.line_name for p in self._purify_depends(package, g, purge=True)
-                ]
-            self.config['project']['dependencies'] = [p.line_name for p in depends]
+        change = ('add', Package(package), group)
+        self._changes.append(change)
+        self._apply(*change)
 
     def del_package(self, package):
-        self.config['project']['dependencies'] = [
-            p.line_name for p in self._purify_depends(package, purge=True)
-        ]
-        self.config['project']['optional-dependencies'] = {
-            g: depends
-            for g in self.get_optional_groups()
-            if (
-                depends := [
-                    p.line_name for p in self._purify_depends(package, g, purge=True)
-                ]
-            )
-        }
+        change = ('del', Package(package))
+        self._changes.append(change)
+        self._apply(*change)
 
     def get_optional_groups(self):
-        optional = self.config['project']['optional-dependencies']
-        return optional.keys()
+        return [g for g in self.depends if g]
+
+    def get_tool_config(self):
+        return self.config.get('tool', {}).get('podao', {})
+
+    def get_targets(self):
+        targets = []
+        for t in self.get_tool_config().get('targets', []):
+            platform = t.get('platform', [])
+            platforms = [platform] if isinstance(platform, str) else platform
+            values = {k: v for k, v in t.items() if k != 'platform'}
+            # An unquoted `python = 3.10` is the float 3.1 once parsed.
+            for k, v in [*values.items(), *(('platform', p) for p in platforms)]:
+                if not isinstance(v, str):
+                    raise Exception(
+                        f'Target {k} in [tool.podao] of {PYPROJECT_FILE} must be '
+                        f'a quoted string, got {v}'
+                    )
+            target = {k: str(v) for k, v in values.items()}
+            target['platforms'] = [str(p) for p in platforms]
+            if 'name' not in target:
+                parts = [f'py{target["python"]}'] if 'python' in target else []
+                parts += target['platforms'][:1]
+                target['name'] = '-'.join(parts) or 'default'
+            targets.append(target)
+        return targets
 
     def get_dependencies(self, group=None):
-        project = self.config.get('project', {})
-        if group:
-            optional = project.get('optional-dependencies', {})
-            return optional.get(group, [])
-        else:
-            return project.get('dependencies', [])
+        return list(self.depends.get(group or '', {}).values())
+
+
+class Workspace:
+    def __init__(self, root, jobs=None, **options):
+        self.root = os.path.normpath(os.path.abspath(root))
+        self.jobs = jobs or min(32, os.cpu_count() or 1)
+        self.options = options
+        self.projects = find_projects(self.root)
+
+    def _work(self, dir, action, args):
+        try:
+            return dir, list(getattr(Project(dir, **self.options), action)(*args)), None
+        except Exception as e:
+            return dir, [], e
+
+    def run(self, action, *args):
+        with ThreadPoolExecutor(self.jobs) as pool:
+            yield from pool.map(lambda d: self._work(d, action, args), self.projects)
 
 
 class Package:
-    def __init__(self, line):
-        req = Requirement(self._normalize_line(line))
+    '''
+    A requirement line keyed on the PEP 503 canonical name of the package,
+    so `Django` and `django`, `foo_bar` and `foo-bar` are the same package.
+    Packages are immutable and interned, parsing the same line again
+    returns the same object.
+    '''
+
+    __slots__ = ('name', 'key', 'extras', 'marker', 'line_name', '_hash')
+
+    def __new__(cls, line):
+        return cls._parse(line)
+
+    @classmethod
+    @lru_cache(maxsize=8192)
+    def _parse(cls, line):
+        req = Requirement(line)
+        self = super().__new__(cls)
         self.name = req.name
-        self.extras = req.extras
+        self.key = sys.intern(canonicalize_name(req.name))
+        self.extras = frozenset(req.extras)
         self.marker = req.marker
         self.line_name = str(req)
-
-    def _normalize_line(self, line):
-        return line
+        self._hash = hash(self.key)
+        return self
 
     def __hash__(self):
-        return hash((self.__class__.__name__, str(self.name)))
+        return self._hash
 
     def __eq__(self, other):
-        return self.name == other.name
+        if not isinstance(other, Package):
+            return NotImplemented
+        return self.key == other.key
 
     def __str__(self):
         return self.line_name
+
+    def __repr__(self):
+        return f'Package({self.line_name!r})'
@@ -0,0 +1,410 @@
+import glob
+import io
+import json
+import os
+import re
+import zipfile
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import HeaderParser
+from functools import cache
+
+import sh
+
+from packaging.markers import default_environment
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.tags import compatible_tags, cpython_tags, generic_tags
+from packaging.utils import (
+    InvalidSdistFilename,
+    InvalidWheelFilename,
+    canonicalize_name,
+    parse_sdist_filename,
+    parse_wheel_filename,
+)
+from packaging.version import Version
+
+from podao.constant import (
+    IMPLEMENTATIONS,
+    MARKER_ENV_SCRIPT,
+    PLATFORM_MARKERS,
+    WINDOWS_MACHINES,
+)
+from podao.profile import phase
+from podao.util import disk_cache, mtimes
+
+
+Distribution = namedtuple('Distribution', ['name', 'version', 'requires'])
+
+# Bumped when reading the metadata changes, cached scans are read again.
+SCAN_VERSION = 2
+
+
+def site_packages(root):
+    for pattern in (('lib', 'python*', 'site-packages'), ('Lib', 'site-packages')):
+        if paths := sorted(glob.glob(os.path.join(root, *pattern))):
+            return paths[-1]
+    return None
+
+
+@cache
+def _marker_env(python):
+    return disk_cache(
+        f'marker-env:{python}',
+        mtimes(python),
+        lambda: json.loads(str(sh.Command(python)('-c', MARKER_ENV_SCRIPT))),
+    )
+
+
+def marker_env(root):
+    python = os.path.join(root, 'bin', 'python')
+    if not os.path.exists(python):
+        return default_environment()
+    return _marker_env(os.path.realpath(python))
+
+
+def parse_metadata(lines):
+    meta = HeaderParser().parsestr(''.join(lines))
+    if not (meta['Name'] and meta['Version']):
+        return None
+    return Distribution(meta['Name'], meta['Version'], meta.get_all('Requires-Dist', []))
+
+
+def header_lines(f):
+    # Only the header block is needed, stop before the long description. A
+    # whitespace only line continues a folded value, e.g. a long License.
+    lines = []
+    for line in f:
+        if not line.rstrip('\r\n'):
+            break
+        lines.append(line)
+    return lines
+
+
+def read_dist(path):
+    try:
+        with open(os.path.join(path, 'METADATA'), encoding='utf-8') as f:
+            return parse_metadata(header_lines(f))
+    except OSError:
+        return None
+
+
+def read_wheel(path):
+    try:
+        with zipfile.ZipFile(path) as z:
+            for name in z.namelist():
+                if re.match(r'^[^/]+\.dist-info/METADATA$', name):
+                    with z.open(name) as f:
+                        return parse_metadata(header_lines(io.TextIOWrapper(f, 'utf-8')))
+    except (OSError, zipfile.BadZipFile):
+        pass
+    return None
+
+
+def scan_dists(root):
+    if not (path := site_packages(root)):
+        return {}
+
+    paths = glob.glob(os.path.join(path, '*.dist-info'))
+    with ThreadPoolExecutor() as pool:
+        dists = pool.map(read_dist, paths)
+    return {canonicalize_name(d.name): d for d in dists if d}
+
+
+def editable_dists(root):
+    '''
+    Return the canonical names of the distributions installed in editable
+    mode, i.e. `pip install -e`, which record it in direct_url.json.
+    '''
+    if not (path := site_packages(root)):
+        return set()
+
+    names = set()
+    for direct_url in glob.glob(os.path.join(path, '*.dist-info', 'direct_url.json')):
+        try:
+            with open(direct_url, encoding='utf-8') as f:
+                editable = json.load(f).get('dir_info', {}).get('editable')
+        except (OSError, ValueError, AttributeError):
+            continue
+        if editable:
+            dist_info = os.path.basename(os.path.dirname(direct_url))
+            names.add(
+                canonicalize_name(dist_info[: -len('.dist-info')].rsplit('-', 1)[0])
+            )
+    return names
+
+
+def parse_dist_filename(filename):
+    try:
+        if filename.endswith('.whl'):
+            return parse_wheel_filename(filename)[:2]
+        return parse_sdist_filename(filename)
+    except (InvalidWheelFilename, InvalidSdistFilename):
+        return None
+
+
+@phase
+def load_dists(root):
+    path = site_packages(root)
+    if not path:
+        return {}
+
+    dists = disk_cache(
+        f'dists:{os.path.realpath(root)}',
+        [SCAN_VERSION, *mtimes(os.path.join(root, 'pyvenv.cfg'), path)],
+        lambda: scan_dists(root),
+    )
+    return {k: Distribution(*v) for k, v in dists.items()}
+
+
+def scan_wheelhouse(dir):
+    '''
+    Return {name: [(version, filename, tags)]} of the distributions in a
+    wheelhouse, `tags` is None for sdists which can be built anywhere.
+    '''
+    files = {}
+    for filename in sorted(os.listdir(dir)) if os.path.isdir(dir) else []:
+        try:
+            if filename.endswith('.whl'):
+                name, version, _, tags = parse_wheel_filename(filename)
+            else:
+                (name, version), tags = parse_sdist_filename(filename), None
+        except (InvalidWheelFilename, InvalidSdistFilename):
+            continue
+        files.setdefault(name, []).append((version, filename, tags))
+    return files
+
+
+def target_env(env, target):
+    '''
+    Marker environment of a [tool.podao] target, derived from `env` of the
+    local interpreter and the target python, platform and implementation.
+    '''
+    env = dict(env)
+    if python := target.get('python'):
+        env['python_version'] = '.'.join(python.split('.')[:2])
+        env['python_full_version'] = python if python.count('.') > 1 else f'{python}.0'
+    if implementation := target.get('implementation'):
+        name = IMPLEMENTATIONS.get(implementation, implementation)
+        env['implementation_name'] = name.lower()
+        env['platform_python_implementation'] = name
+    for platform in target.get('platforms', [])[:1]:
+        for prefix, (sys_platform, system, os_name) in PLATFORM_MARKERS.items():
+            if platform.startswith(prefix):
+                env.update(
+                    sys_platform=sys_platform, platform_system=system, os_name=os_name
+                )
+                break
+        machine = re.sub(r'^(?:[a-z]+\d*)(?:_\d+)*_', '', platform)
+        env['platform_machine'] = WINDOWS_MACHINES.get(platform, machine)
+    return env
+
+
+def target_tags(target, env):
+    version = tuple(int(v) for v in env['python_version'].split('.'))
+    implementation = target.get('implementation') or 'cp'
+    interpreter = f'{implementation}{version[0]}{version[1]}'
+    platforms = target.get('platforms') or None
+    if implementation == 'cp':
+        tags = list(cpython_tags(version, platforms=platforms))
+    else:
+        tags = list(generic_tags(interpreter, platforms=platforms))
+    return set(tags + list(compatible_tags(version, interpreter, platforms)))
+
+
+def target_dists(dists, wheelhouse, dir, tags):
+    '''
+    Merge the installed `dists` with the wheelhouse for a target: installed
+    versions are kept, packages missing locally are read from the best
+    compatible wheel. Returns the merged dists and notes on wheelhouse gaps.
+    '''
+    merged = dict(dists)
+    notes = []
+    for name, files in wheelhouse.items():
+        usable = [f for f in files if f[2] is None or f[2] & tags]
+        if name in dists:
+            version = Version(dists[name].version)
+            if not any(v == version for v, _, _ in usable):
+                notes.append(f'No compatible {name}=={version} in the wheelhouse')
+            continue
+        if not usable:
+            notes.append(f'No compatible {name} in the wheelhouse')
+            continue
+        version, filename, _ = max(usable, key=lambda f: (f[0], f[2] is not None))
+        if dist := read_wheel(os.path.join(dir, filename)):
+            merged[name] = dist
+        else:
+            merged[name] = Distribution(name, str(version), [])
+    return merged, notes
+
+
+class DependencyGraph:
+    def __init__(self, dists, env=None):
+        self.dists = dists
+        self.env = env or default_environment()
+        self._requires = {}
+        self._edges = {}
+
+    def requires(self, name):
+        if name not in self._requires:
+            reqs = []
+            for line in self.dists[name].requires if name in self.dists else []:
+                try:
+                    reqs.append(Requirement(line))
+                except InvalidRequirement:
+                    continue
+            self._requires[name] = reqs
+        return self._requires[name]
+
+    def edges(self, name, extra=None):
+        key = (name, extra)
+        if key not in self._edges:
+            self._edges[key] = [
+                (canonicalize_name(r.name), r.extras)
+                for r in self.requires(name)
+                if self._wanted(r, extra)
+            ]
+        return self._edges[key]
+
+    def _wanted(self, req, extra):
+        if not req.marker:
+            return extra is None
+        return req.marker.evaluate({**self.env, 'extra': extra or ''})
+
+    def closure(self, roots):
+        return {name for name in self.walk(roots) if name in self.dists}
+
+    def walk(self, roots):
+        # Nodes are (name, extra) pairs, the seen set doubles as cycle detection.
+        seen = set()
+        stack = []
+        for name, extras in roots:
+            name = canonicalize_name(name)
+            stack.append((name, None))
+            stack.extend((name, e) for e in extras)
+
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            for dep, extras in self.edges(*node):
+                stack.append((dep, None))
+                stack.extend((dep, e) for e in extras)
+
+        return {name for name, _ in seen}
+
+
+def split_node(node):
+    name, _, extra = node.partition('[')
+    return name, extra[:-1] or None
+
+
+def node_names(name, extras=()):
+    return [name] + [f'{name}[{e}]' for e in sorted(extras)]
+
+
+class DependencyIndex:
+    '''
+    Forward and reverse dependency edges of an environment, serializable to
+    json. Nodes are `name` or `name[extra]` with canonical names, `update`
+    only reads the metadata of the dist-info directories which changed.
+    '''
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.stamps = data.get('stamps')
+        self.entries = data.get('entries', {})
+        self.forward = data.get('forward', {})
+        self.reverse = data.get('reverse', {})
+        self._dists()
+
+    def _dists(self):
+        self.dists = {
+            canonicalize_name(e[0]): Distribution(*e) for e in self.entries.values() if e
+        }
+
+    def to_json(self):
+        return {
+            'stamps': self.stamps,
+            'entries': self.entries,
+            'forward': self.forward,
+            'reverse': self.reverse,
+        }
+
+    def update(self, root, roots=()):
+        path = site_packages(root)
+        found = set(glob.glob('*.dist-info', root_dir=path)) if path else set()
+        stamps = [SCAN_VERSION, *mtimes(os.path.join(root, 'pyvenv.cfg'))]
+        if stamps != self.stamps:
+            # A new interpreter changes the markers, a new SCAN_VERSION the
+            # metadata read, start over.
+            self.entries, self.forward = {}, {}
+
+        added = found - self.entries.keys()
+        removed = self.entries.keys() - found
+        changed = set()
+        for entry in removed:
+            if dist := self.entries.pop(entry):
+                changed.add(canonicalize_name(dist[0]))
+        for entry in added:
+            dist = read_dist(os.path.join(path, entry))
+            self.entries[entry] = list(dist) if dist else None
+            if dist:
+                changed.add(canonicalize_name(dist.name))
+        self._dists()
+
+        for node in list(self.forward):
+            if split_node(node)[0] in changed:
+                del self.forward[node]
+        wanted = set(self.dists) | set(roots)
+        wanted.update(n for nodes in self.forward.values() for n in nodes)
+        pending = [
+            n for n in wanted if n not in self.forward and split_node(n)[0] in self.dists
+        ]
+
+        computed = bool(pending)
+        if pending:
+            graph = DependencyGraph(self.dists, marker_env(root))
+            while pending:
+                node = pending.pop()
+                name, extra = split_node(node)
+                if node in self.forward or name not in self.dists:
+                    continue
+                nodes = [name] if extra else []
+                for dep, extras in graph.edges(name, extra):
+                    nodes += node_names(dep, extras)
+                self.forward[node] = sorted(set(nodes))
+                pending.extend(nodes)
+
+        if not (added or removed or computed or stamps != self.stamps):
+            return False
+        self.stamps = stamps
+        reverse = {}
+        for node, nodes in self.forward.items():
+            for dep in {split_node(n)[0] for n in nodes} - {split_node(node)[0]}:
+                reverse.setdefault(dep, set()).add(split_node(node)[0])
+        self.reverse = {k: sorted(v) for k, v in reverse.items()}
+        return True
+
+    def children(self, name, extras=()):
+        '''
+        Return {dependency: extras} of `name` installed with `extras`.
+        '''
+        deps = {}
+        for node in node_names(name, extras):
+            for dep in self.forward.get(node, []):
+                dep, extra = split_node(dep)
+                if dep != name:
+                    deps.setdefault(dep, set()).update([extra] if extra else [])
+        return deps
+
+    def closure(self, roots):
+        seen = set()
+        stack = list(roots)
+        while stack:
+            if (node := stack.pop()) in seen:
+                continue
+            seen.add(node)
+            stack.extend(self.forward.get(node, []))
+        return {split_node(n)[0] for n in seen} & self.dists.keys()
@@ -0,0 +1,195 @@
+import functools
+import inspect
+import json
+import os
+import re
+import resource
+import threading
+import time
+
+from collections import namedtuple
+from contextlib import contextmanager
+
+import sh
+
+
+Record = namedtuple(
+    'Record', ['kind', 'name', 'detail', 'start', 'wall', 'cpu', 'status', 'tid']
+)
+
+
+class Profiler:
+    '''
+    Collect the wall time, CPU time and exit status of `Project` phases and
+    of every `sh` subprocess while enabled.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._children = 0.0
+        self._started = {}
+
+    def enable(self):
+        self.enabled = True
+        self.records = []
+        self.origin = time.perf_counter()
+        self._children = self._children_cpu()
+        # The class defaults are copied into every call, so this reaches all
+        # sh commands, including the ones baked before profiling started.
+        sh.Command._call_args.update(log_msg=self._log_msg, done=self._done)
+
+    def disable(self):
+        self.enabled = False
+        if sh.Command._call_args['done'] == self._done:
+            sh.Command._call_args.update(log_msg=None, done=None)
+
+    def _children_cpu(self):
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    def _log_msg(self, ran, call_args, pid=None):
+        # sh calls this right before spawning the process, `done` may run
+        # before the RunningCommand knows its process so the start is kept here.
+        if pid is None:
+            self._started[id(call_args)] = time.perf_counter()
+            return f'<Command {ran!r}>'
+        return f'<Command {ran!r}, pid {pid}>'
+
+    def _done(self, cmd, success, exit_code):
+        end = time.perf_counter()
+        start = self._started.pop(id(cmd.call_args), end)
+        with self._lock:
+            # The callback runs right after the child is reaped, so the
+            # children usage grown since the previous reap belongs to it.
+            total = self._children_cpu()
+            cpu, self._children = total - self._children, total
+            self._add(
+                'process',
+                command_name(cmd.cmd),
+                cmd.ran,
+                start,
+                end - start,
+                cpu,
+                exit_code,
+                cmd.process and cmd.process.pid,
+            )
+
+    def _add(self, kind, name, detail, start, wall, cpu, status=0, tid=None):
+        self.records.append(
+            Record(
+                kind,
+                name,
+                detail,
+                start - self.origin,
+                wall,
+                cpu,
+                status,
+                tid or threading.get_native_id(),
+            )
+        )
+
+    @contextmanager
+    def measure(self, name, detail=''):
+        start, cpu = time.perf_counter(), time.process_time()
+        status = 0
+        try:
+            yield
+        except BaseException as e:
+            status = type(e).__name__
+            raise
+        finally:
+            with self._lock:
+                self._add(
+                    'phase',
+                    name,
+                    detail,
+                    start,
+                    time.perf_counter() - start,
+                    time.process_time() - cpu,
+                    status,
+                )
+
+    def summary(self):
+        groups = {}
+        for r in self.records:
+            g = groups.setdefault((r.kind, r.name), [0, 0.0, 0.0, 0])
+            g[0] += 1
+            g[1] += r.wall
+            g[2] += r.cpu
+            g[3] += r.status != 0
+
+        w = max([len(n) for _, n in groups] + [4])
+        yield f'{"kind":<8} {"name":<{w}} {"calls":>5} {"wall":>9} {"cpu":>9} {"failed":>6}'
+        for (kind, name), (calls, wall, cpu, failed) in sorted(
+            groups.items(), key=lambda g: -g[1][1]
+        ):
+            yield f'{kind:<8} {name:<{w}} {calls:>5} {wall:>8.3f}s {cpu:>8.3f}s {failed:>6}'
+        yield f'Total {time.perf_counter() - self.origin:.3f}s'
+
+    def to_json(self):
+        return [r._asdict() for r in self.records]
+
+    def to_trace(self):
+        # Chrome trace event format, load it in chrome://tracing or Perfetto.
+        pid = os.getpid()
+        return {
+            'traceEvents': [
+                {
+                    'name': r.name,
+                    'cat': r.kind,
+                    'ph': 'X',
+                    'ts': r.start * 1e6,
+                    'dur': r.wall * 1e6,
+                    'pid': pid,
+                    'tid': r.tid,
+                    'args': {'detail': r.detail, 'cpu': r.cpu, 'status': r.status},
+                }
+                for r in self.records
+            ],
+            'displayTimeUnit': 'ms',
+        }
+
+    def dump(self, path, format='json'):
+        with open(path, 'w') as f:
+            json.dump(self.to_trace() if format == 'trace' else self.to_json(), f)
+
+
+def command_name(cmd):
+    # `pip install -U x` is reported as `pip install`, options and values are
+    # left to the detail.
+    parts = [os.path.basename(str(cmd[0]))]
+    if len(cmd) > 1 and re.match(r'^[a-z][\w-]*$', str(cmd[1])):
+        parts.append(str(cmd[1]))
+    return ' '.join(parts)
+
+
+profiler = Profiler()
+
+
+def phase(func):
+    '''
+    Record every call of `func` as a profiling phase, generator functions are
+    measured until they are exhausted.
+    '''
+    if inspect.isgeneratorfunction(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return (yield from func(*args, **kwargs))
+            with profiler.measure(func.__qualname__):
+                return (yield from func(*args, **kwargs))
+
+    else:
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            with profiler.measure(func.__qualname__):
+                return func(*args, **kwargs)
+
+    return wrapper
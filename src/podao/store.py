@@ -0,0 +1,129 @@
+import configparser
+import csv
+import fcntl
+import os
+import shutil
+import tempfile
+import zipfile
+
+from podao.constant import SCRIPT_TPL, STORE_DIR
+from podao.util import cache_dir, file_hash
+
+
+FICLONE = 0x40049409
+
+
+def link_file(src, dst):
+    '''
+    Populate `dst` with the content of `src`, sharing the data blocks when
+    the file system allows it: hardlink first, then reflink, then plain copy.
+    '''
+    try:
+        os.link(src, dst)
+        return 'link'
+    except OSError:
+        pass
+
+    try:
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        shutil.copystat(src, dst)
+        return 'reflink'
+    except OSError:
+        shutil.copy2(src, dst)
+        return 'copy'
+
+
+class WheelStore:
+    def __init__(self, root=None):
+        self.root = root or os.path.join(cache_dir(), STORE_DIR)
+        self.wheels = os.path.join(self.root, 'wheels')
+        self.trees = os.path.join(self.root, 'trees')
+        os.makedirs(self.wheels, exist_ok=True)
+        os.makedirs(self.trees, exist_ok=True)
+
+    def add(self, path):
+        filename = os.path.basename(path)
+        tree = os.path.join(self.trees, f'{filename[:-4]}-{file_hash(path)[:16]}')
+        if os.path.isdir(tree):
+            return tree
+
+        if not os.path.exists(os.path.join(self.wheels, filename)):
+            shutil.copy2(path, os.path.join(self.wheels, filename))
+
+        tmp = tempfile.mkdtemp(suffix='-tmp', dir=self.trees)
+        try:
+            with zipfile.ZipFile(path) as z:
+                z.extractall(tmp)
+            os.rename(tmp, tree)
+        except OSError:
+            # Another process unpacked the same wheel first.
+            if not os.path.isdir(tree):
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return tree
+
+    def linkable(self, tree):
+        return not any(d.endswith('.data') for d in os.listdir(tree))
+
+    def link(self, tree, site_packages, bin_dir):
+        records = []
+        dist_info = None
+        for dir, _, files in os.walk(tree):
+            rel = os.path.relpath(dir, tree)
+            os.makedirs(os.path.join(site_packages, rel), exist_ok=True)
+            if rel.split(os.sep)[0].endswith('.dist-info'):
+                dist_info = os.path.join(site_packages, rel.split(os.sep)[0])
+                for f in files:
+                    shutil.copy2(
+                        os.path.join(dir, f), os.path.join(site_packages, rel, f)
+                    )
+                continue
+            for f in files:
+                dst = os.path.join(site_packages, rel, f)
+                if os.path.lexists(dst):
+                    os.unlink(dst)
+                link_file(os.path.join(dir, f), dst)
+
+        with open(os.path.join(dist_info, 'INSTALLER'), 'w') as f:
+            f.write('podao\n')
+        records.append(os.path.join(os.path.basename(dist_info), 'INSTALLER'))
+
+        for script in self._gen_scripts(dist_info, bin_dir):
+            records.append(os.path.relpath(script, site_packages))
+
+        with open(os.path.join(dist_info, 'RECORD'), 'a', newline='') as f:
+            csv.writer(f).writerows((r, '', '') for r in records)
+        return dist_info
+
+    def _gen_scripts(self, dist_info, bin_dir):
+        entry_points = os.path.join(dist_info, 'entry_points.txt')
+        if not os.path.exists(entry_points):
+            return []
+
+        parser = configparser.ConfigParser(delimiters=('=',))
+        parser.optionxform = str
+        parser.read(entry_points)
+        python = os.path.join(bin_dir, 'python')
+
+        scripts = []
+        for section in ('console_scripts', 'gui_scripts'):
+            if not parser.has_section(section):
+                continue
+            for name, value in parser.items(section):
+                module, _, attr = value.partition(':')
+                attr = attr.split('[')[0].strip()
+                path = os.path.join(bin_dir, name)
+                with open(path, 'w') as f:
+                    f.write(
+                        SCRIPT_TPL.format(
+                            python=python,
+                            module=module.strip(),
+                            head=attr.split('.')[0],
+                            attr=attr,
+                        )
+                    )
+                os.chmod(path, 0o755)
+                scripts.append(path)
+        return scripts
@@ -1,39 +1,106 @@
+import fcntl
+import hashlib
+import json
 import os
+import queue
+import re
 import shutil
-import tempfile
+import threading
+import time
+import uuid
 
 from contextlib import contextmanager
-from functools import wraps
+from functools import cache
 
 import sh
+import tomlkit
+
+from podao.constant import CACHE_DIR, PYPROJECT_FILE, VERSION_REGEX
 
 
 def check_pyenv():
+    if not (pyenv := shutil.which('pyenv')):
+        return False
+
     try:
-        return sh.pyenv('--version')
+        return disk_cache(
+            'pyenv-version',
+            mtimes(os.path.realpath(pyenv), pyenv_root()),
+            lambda: str(sh.pyenv('--version')).strip(),
+        )
     except sh.CommandNotFound:
         return False
 
 
-def check_pyvenv():
-    for dir, _, _ in walk_dir_up(os.getcwd(), 2):
-        pyvenv = os.path.join(dir, 'pyvenv.cfg')
-        if os.path.isfile(pyvenv):
-            return dir
-        else:
-            return False
+def pyenv_root():
+    return os.environ.get('PYENV_ROOT') or os.path.expanduser('~/.pyenv')
+
+
+def available_pythons():
+    return disk_cache(
+        'pyenv-install-list',
+        mtimes(
+            pyenv_root(),
+            os.path.join(
+                pyenv_root(), 'plugins', 'python-build', 'share', 'python-build'
+            ),
+        ),
+        lambda: [
+            v.strip()
+            for v in sh.pyenv('install', '--list').splitlines()
+            if re.match(VERSION_REGEX, v)
+        ],
+    )
 
 
-def singleton(cls):
-    instances = {}
+def check_pyvenv(dir=None, depth=None, active=True):
+    '''
+    Return the project environment of `dir` (default the working directory):
+    the activated one from `VIRTUAL_ENV` if `active`, otherwise the nearest
+    ancestor with a pyvenv.cfg, or False.
+    '''
+    if active and (venv := os.environ.get('VIRTUAL_ENV')):
+        if os.path.isfile(os.path.join(venv, 'pyvenv.cfg')):
+            return os.path.normpath(venv)
 
-    @wraps(cls)
-    def get_instance(*args, **kwargs):
-        if cls not in instances:
-            instances[cls] = cls(*args, **kwargs)
-        return instances[cls]
+    if depth is None and (env := os.environ.get('PODAO_SEARCH_DEPTH')):
+        depth = int(env)
+    return _find_pyvenv(os.path.abspath(dir or os.getcwd()), depth)
 
-    return get_instance
+
+@cache
+def _find_pyvenv(dir, depth=None):
+    # Only stat the two marker files per level, listing large or remote
+    # directories is what makes the lookup slow.
+    device = None
+    for level, cur in enumerate(dirs_up(dir)):
+        if depth is not None and level > depth:
+            break
+        try:
+            st = os.stat(cur)
+        except OSError:
+            continue
+        if device is not None and st.st_dev != device:
+            break
+        device = st.st_dev
+
+        if os.path.isfile(os.path.join(cur, 'pyvenv.cfg')):
+            return cur
+        if os.path.isfile(os.path.join(cur, PYPROJECT_FILE)):
+            # A project without an environment, an outer one is not its own.
+            break
+    return False
+
+
+def find_projects(root):
+    projects = []
+    for dir, dirs, files in os.walk(root):
+        if 'pyvenv.cfg' in files:
+            projects.append(dir)
+            dirs.clear()
+        else:
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+    return projects
 
 
 def create_dir(root, dir):
@@ -54,31 +121,140 @@ def atomic_write(path, overwrite=True, encoding='utf-8'):
     dir = os.path.dirname(path)
     if not os.path.exists(dir):
         os.makedirs(dir)
-    fd, name = tempfile.mkstemp(suffix='-tmp', dir=dir)
+
+    # mkstemp creates 0600 files, open the temp file ourselves to honour umask.
+    while True:
+        name = os.path.join(dir, f'.{os.path.basename(path)}.{uuid.uuid4().hex[:8]}-tmp')
+        try:
+            fd = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            break
+        except FileExistsError:
+            continue
     fp = open(fd, 'w', encoding=encoding)
 
     try:
         yield fp
-    except Exception:
+        fp.flush()
+        os.fsync(fp.fileno())
         fp.close()
-        raise
-    else:
+        if os.path.exists(path):
+            shutil.copymode(path, name)
+        os.replace(name, path)
+    except BaseException:
         fp.close()
-        shutil.copyfile(name, str(path))
+        if os.path.exists(name):
+            os.unlink(name)
+        raise
+
+    dfd = os.open(dir, os.O_RDONLY)
+    try:
+        os.fsync(dfd)
     finally:
-        os.unlink(name)
-
-
-def walk_dir_up(cur, max=3):
-    cur = os.path.realpath(cur)
-    dirs, files = [], []
-    for entry in os.scandir(cur):
-        if entry.is_dir():
-            dirs.append(entry.name)
-        elif entry.is_file():
-            files.append(entry.name)
-    yield cur, dirs, files
-
-    up = os.path.realpath(os.path.join(cur, ".."))
-    if up != cur and max > 0:
-        yield from walk_dir_up(up, max - 1)
+        os.close(dfd)
+
+
+def stream(cmd, *args, **kwargs):
+    '''
+    Run `cmd` and yield its merged stdout/stderr line by line as it is
+    produced, followed by the elapsed time of the step. A failed command
+    raises once all its output was yielded.
+    '''
+    # `_iter` would also keep the whole output in the command's buffers, the
+    # lines are handed over by the callback and dropped by sh instead.
+    lines = queue.SimpleQueue()
+    errors = []
+    start = time.perf_counter()
+    p = cmd(
+        *args,
+        _out=lines.put,
+        _no_out=True,
+        _err_to_out=True,
+        _tty_out=False,
+        _bg=True,
+        _bg_exc=False,
+        **kwargs,
+    )
+
+    def wait():
+        try:
+            p.wait()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            lines.put(None)
+
+    threading.Thread(target=wait, daemon=True).start()
+    while (line := lines.get()) is not None:
+        yield f'    {line.rstrip()}'
+    if errors:
+        raise errors[0]
+    yield f'    Done in {time.perf_counter() - start:.1f}s'
+
+
+def cache_dir():
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(root, CACHE_DIR)
+
+
+def mtimes(*paths):
+    return [os.stat(p).st_mtime_ns if os.path.exists(p) else None for p in paths]
+
+
+def disk_cache(key, stamps, compute):
+    '''
+    Return the cached value of `key` if it was stored with the same `stamps`,
+    otherwise compute, store and return it. The value must be JSON serializable.
+    '''
+    path = os.path.join(cache_dir(), hashlib.sha1(key.encode()).hexdigest() + '.json')
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data['key'] == key and data['stamps'] == stamps:
+            return data['value']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    value = compute()
+    try:
+        with atomic_write(path) as f:
+            json.dump({'key': key, 'stamps': stamps, 'value': value}, f)
+    except OSError:
+        pass
+    return value
+
+
+def file_hash(path, algorithm='sha256'):
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def toml_string(value):
+    return tomlkit.string(value, literal=not ("'" in value or '\n' in value))
+
+
+def toml_array(values, multiline=False):
+    array = tomlkit.array()
+    array.extend(toml_string(v) for v in values)
+    return array.multiline(multiline)
+
+
+@contextmanager
+def file_lock(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def dirs_up(dir):
+    while True:
+        yield dir
+        if (up := os.path.dirname(dir)) == dir:
+            return
+        dir = up
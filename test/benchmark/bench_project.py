@@ -0,0 +1,223 @@
+'''
+Benchmarks for the Project operations that run on every pd command.
+
+Synthetic projects are generated with a growing number of dependencies and
+optional groups, each with a fake site-packages tree, then every operation is
+timed and the scaling exponent between the smallest and largest size is
+reported, so a change which turns a linear path quadratic stands out:
+
+    PYTHONPATH=src python test/benchmark/bench_project.py
+    PYTHONPATH=src python test/benchmark/bench_project.py -s 10 -s 100 -g 1 -g 50
+    PYTHONPATH=src python test/benchmark/bench_project.py -o new.json -b old.json
+'''
+
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from podao.constant import FREEZE_STATE_FILE, PODAO_DIR, PYPROJECT_FILE
+from podao.main import Project
+
+
+SIZES = (10, 100, 1000)
+GROUPS = (1, 10, 50)
+# Every direct dependency pulls in this many transitive ones.
+FANOUT = 2
+
+
+def make_pyproject(root, deps, groups):
+    names = [f'pkg{i}' for i in range(deps)]
+    main, optional = names[::2], names[1::2]
+    lines = ['[project]', "name = 'bench'", 'dependencies = [']
+    lines += [f"    '{n}>={i % 9}.0'," for i, n in enumerate(main)]
+    lines += [']', '', '[project.optional-dependencies]']
+    for g in range(groups):
+        lines.append(f'group{g} = [')
+        lines += [f"    '{n}[extra]'," for n in optional[g::groups]]
+        lines.append(']')
+    lines += ['', '[tool.black]', 'line-length = 90', '']
+    with open(os.path.join(root, PYPROJECT_FILE), 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def make_dist(sp, name, requires=()):
+    path = os.path.join(sp, f'{name}-1.0.dist-info')
+    os.makedirs(path)
+    with open(os.path.join(path, 'METADATA'), 'w') as f:
+        f.write(f'Metadata-Version: 2.1\nName: {name}\nVersion: 1.0\n')
+        for r in requires:
+            f.write(f'Requires-Dist: {r}\n')
+        f.write('\n' + 'Long description.\n' * 100)
+
+
+def make_site_packages(root, deps):
+    with open(os.path.join(root, 'pyvenv.cfg'), 'w') as f:
+        f.write('version = 3.10.4\n')
+    sp = os.path.join(root, 'lib', 'python3.10', 'site-packages')
+    os.makedirs(sp)
+    for i in range(deps):
+        subs = [f'sub{i}x{j}' for j in range(FANOUT)]
+        requires = [
+            subs[0],
+            f'{subs[1]}; extra == "extra"',
+            'missing; python_version < "3"',
+        ]
+        make_dist(sp, f'pkg{i}', requires)
+        for s in subs:
+            make_dist(sp, s)
+
+
+def make_project(deps, groups):
+    root = tempfile.mkdtemp(prefix=f'bench-{deps}-{groups}-')
+    make_pyproject(root, deps, groups)
+    make_site_packages(root, deps)
+    return root
+
+
+def consume(gen):
+    for _ in gen:
+        pass
+
+
+def add_package(root):
+    p = Project(root)
+    for i in range(10):
+        p.add_package(f'new{i}>=1', f'group{i}')
+
+
+def del_package(root):
+    p = Project(root)
+    for i in range(0, 20, 2):
+        p.del_package(f'pkg{i}')
+
+
+def gen_pyproject(root):
+    p = Project(root)
+    p.add_package('new>=1')
+    consume(p._gen_pyproject())
+    # Restore the file, the next round must start from the same input.
+    p.del_package('new')
+    consume(p._gen_pyproject())
+
+
+def freeze(root):
+    # Without its state a freeze is computed again instead of being skipped.
+    state = os.path.join(root, PODAO_DIR, FREEZE_STATE_FILE)
+    if os.path.exists(state):
+        os.unlink(state)
+    consume(Project(root).freeze('all'))
+
+
+OPERATIONS = {
+    'load': lambda root: Project(root),
+    'add_package': add_package,
+    'del_package': del_package,
+    'gen_pyproject': gen_pyproject,
+    'snap_packages': lambda root: Project(root).snap_packages('all'),
+    'freeze': freeze,
+}
+
+
+def timeit(func, root, repeat):
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(root)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(sizes, groups, repeat, operations):
+    results = []
+    for deps in sizes:
+        for g in groups:
+            root = make_project(deps, g)
+            # Fill the disk cache once, the steady state is what pd sees.
+            Project(root).snap_packages('all')
+            for name in operations:
+                seconds = timeit(OPERATIONS[name], root, repeat)
+                results.append(
+                    {'operation': name, 'deps': deps, 'groups': g, 'seconds': seconds}
+                )
+                print(f'{name:<14} deps={deps:<5} groups={g:<3} {seconds * 1000:9.2f} ms')
+            shutil.rmtree(root)
+    return results
+
+
+def exponent(results, name, key, fixed):
+    points = sorted(
+        (r[key], r['seconds'])
+        for r in results
+        if r['operation'] == name and all(r[k] == v for k, v in fixed.items())
+    )
+    if len(points) < 2 or points[0][0] == points[-1][0]:
+        return None
+    (x0, y0), (x1, y1) = points[0], points[-1]
+    return math.log(y1 / y0) / math.log(x1 / x0)
+
+
+def report(results, sizes, groups, operations):
+    print()
+    print(f'{"operation":<14} {"deps exp":>9} {"groups exp":>11}')
+    for name in operations:
+        by_deps = exponent(results, name, 'deps', {'groups': max(groups)})
+        by_groups = exponent(results, name, 'groups', {'deps': max(sizes)})
+        print(
+            f'{name:<14} {by_deps if by_deps is not None else "-":>9.3} '
+            f'{by_groups if by_groups is not None else "-":>11.3}'
+        )
+
+
+def compare(results, baseline, threshold):
+    old = {(r['operation'], r['deps'], r['groups']): r['seconds'] for r in baseline}
+    slower = []
+    for r in results:
+        key = (r['operation'], r['deps'], r['groups'])
+        if key in old and r['seconds'] > old[key] * threshold:
+            slower.append((key, old[key], r['seconds']))
+
+    print()
+    for (name, deps, groups), before, after in slower:
+        print(
+            f'SLOWER {name} deps={deps} groups={groups}: '
+            f'{before * 1000:.2f} ms -> {after * 1000:.2f} ms'
+        )
+    return not slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-s', '--size', type=int, action='append', help='dependencies')
+    parser.add_argument('-g', '--groups', type=int, action='append', help='groups')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-p', '--operation', action='append', choices=OPERATIONS)
+    parser.add_argument('-o', '--output', help='write the results as json')
+    parser.add_argument('-b', '--baseline', help='compare with a previous json output')
+    parser.add_argument('-t', '--threshold', type=float, default=1.5)
+    args = parser.parse_args(argv)
+
+    os.environ['XDG_CACHE_HOME'] = tempfile.mkdtemp(prefix='bench-cache-')
+    sizes = args.size or SIZES
+    groups = args.groups or GROUPS
+    operations = args.operation or list(OPERATIONS)
+
+    results = run(sizes, groups, args.repeat, operations)
+    report(results, sizes, groups, operations)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            if not compare(results, json.load(f), args.threshold):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import os
+import zipfile
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path_factory, monkeypatch):
+    path = tmp_path_factory.mktemp('cache')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(path))
+    return path
+
+
+@pytest.fixture
+def make_dist():
+    def make(sp, name, version, requires=(), license=None):
+        path = os.path.join(sp, f'{name.replace("-", "_")}-{version}.dist-info')
+        os.makedirs(path)
+        with open(os.path.join(path, 'METADATA'), 'w') as f:
+            f.write(f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n')
+            if license:
+                # Folded the way setuptools does, blank lines become 8 spaces.
+                f.write('License: ' + '\n        '.join(license.splitlines()) + '\n')
+            for r in requires:
+                f.write(f'Requires-Dist: {r}\n')
+            f.write('\nLong description\nName: bogus\n')
+        return path
+
+    return make
+
+
+@pytest.fixture
+def venv(tmp_path, make_dist):
+    (tmp_path / 'pyvenv.cfg').write_text('version = 3.10.4\n')
+    sp = tmp_path / 'lib' / 'python3.10' / 'site-packages'
+    sp.mkdir(parents=True)
+    make_dist(
+        sp, 'requests', '2.28.1', ['idna<4,>=2.5', 'PySocks!=1.5.7; extra == "socks"']
+    )
+    make_dist(sp, 'idna', '3.4')
+    make_dist(sp, 'Foo_Bar', '1.0')
+    return tmp_path
+
+
+@pytest.fixture
+def make_wheel():
+    def make(dir, name='demo', version='1.0', data=False):
+        path = os.path.join(dir, f'{name}-{version}-py3-none-any.whl')
+        info = f'{name}-{version}.dist-info'
+        with zipfile.ZipFile(path, 'w') as z:
+            z.writestr(f'{name}/__init__.py', 'def main():\n    return 0\n')
+            z.writestr(
+                f'{info}/METADATA',
+                f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n',
+            )
+            z.writestr(
+                f'{info}/WHEEL',
+                'Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: py3-none-any\n',
+            )
+            z.writestr(
+                f'{info}/entry_points.txt', f'[console_scripts]\n{name} = {name}:main\n'
+            )
+            z.writestr(f'{info}/RECORD', f'{name}/__init__.py,,\n')
+            if data:
+                z.writestr(f'{name}-{version}.data/scripts/run', '#!/bin/sh\n')
+        return path
+
+    return make
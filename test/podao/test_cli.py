@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+from click.testing import CliRunner
+
+from podao.cli import pd
+
+
+# Microseconds podao.cli may add on top of click, measured with -X importtime.
+STARTUP_BUDGET = 20000
+HEAVY_MODULES = {'sh', 'tomlkit', 'packaging', 'podao.main', 'podao.util'}
+
+
+def import_times(module):
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:') :].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_startup():
+    times = import_times('podao.cli')
+    assert not [n for n in times if {n, n.split('.')[0]} & HEAVY_MODULES]
+    assert times['podao.cli'] - times['click'] < STARTUP_BUDGET
+
+
+def test_help():
+    result = CliRunner().invoke(pd, ['--help'])
+    assert result.exit_code == 0
+    assert 'freeze' in result.output
@@ -0,0 +1,88 @@
+import os
+import tarfile
+
+import pytest
+
+from podao.interpreter import (
+    find_interpreter,
+    find_prebuilt,
+    pyenv_python,
+    pyenv_versions,
+    select_python,
+    system_pythons,
+    unpack_prebuilt,
+)
+
+
+def make_python(path, version):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(f'#!/bin/sh\necho {version}\n')
+    os.chmod(path, 0o755)
+
+
+@pytest.fixture
+def pyenv(tmp_path, monkeypatch):
+    root = tmp_path / 'pyenv'
+    make_python(root / 'versions' / '3.10.4' / 'bin' / 'python', '3.10.4')
+    (root / 'versions' / 'miniconda3').mkdir()
+    monkeypatch.setenv('PYENV_ROOT', str(root))
+
+    bin = tmp_path / 'bin'
+    make_python(bin / 'python3.9', '3.9.2')
+    make_python(bin / 'python3-config', '')
+    make_python(
+        bin / 'pyenv', '"  2.7.18\n  3.9.2\n  3.10.4\n  3.11.1\n  3.11.2\n  3.12-dev"'
+    )
+    monkeypatch.setenv('PATH', f'{root / "shims"}{os.pathsep}{bin}')
+    return root
+
+
+@pytest.fixture
+def prebuilt(tmp_path):
+    make_python(tmp_path / 'build' / 'python' / 'install' / 'bin' / 'python3', '3.11.1')
+    dir = tmp_path / 'prebuilt'
+    dir.mkdir()
+    path = dir / 'cpython-3.11.1+20230116-x86_64-unknown-linux-gnu-full.tar.gz'
+    with tarfile.open(path, 'w:gz') as t:
+        t.add(tmp_path / 'build' / 'python', 'python')
+    return dir
+
+
+def test_pyenv_versions(pyenv):
+    assert pyenv_versions() == ['3.10.4']
+
+
+def test_system_pythons(pyenv, tmp_path):
+    assert list(system_pythons()) == [('3.9.2', str(tmp_path / 'bin' / 'python3.9'))]
+
+
+def test_find_interpreter(pyenv, prebuilt, tmp_path):
+    assert find_interpreter('3.10.4') == ('pyenv', pyenv_python('3.10.4'))
+    assert find_interpreter('3.9.2') == ('system', str(tmp_path / 'bin' / 'python3.9'))
+    assert find_interpreter('3.11.1') == (None, None)
+    assert find_interpreter('3.11.1', prebuilt) == (
+        'prebuilt',
+        find_prebuilt('3.11.1', prebuilt),
+    )
+    assert find_interpreter('3.12.0', prebuilt) == (None, None)
+
+
+def test_unpack_prebuilt(pyenv, prebuilt):
+    path = unpack_prebuilt(find_prebuilt('3.11.1', prebuilt), '3.11.1')
+    assert path == pyenv_python('3.11.1')
+    assert os.path.islink(path)
+    assert os.path.isfile(os.path.join(os.path.dirname(path), 'python3'))
+    assert sorted(pyenv_versions()) == ['3.10.4', '3.11.1']
+    assert find_interpreter('3.11.1') == ('pyenv', path)
+
+
+def test_select_python(pyenv):
+    assert select_python('3.9.2') == '3.9.2'
+    assert select_python('3.10.4', '>=3.11') == '3.10.4'
+    assert select_python() == '3.10.4'
+    assert select_python(None, '>=3.10') == '3.10.4'
+    assert select_python(None, '>=3.11') == '3.11.2'
+    assert select_python('3.11') == '3.11.2'
+    assert select_python('3.11', '<3.11.2') == '3.11.1'
+    assert select_python(None, '>=4') is None
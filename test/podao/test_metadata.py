@@ -0,0 +1,127 @@
+import os
+import sys
+
+from packaging.markers import default_environment
+
+from podao import metadata
+from podao.metadata import (
+    DependencyGraph,
+    DependencyIndex,
+    load_dists,
+    marker_env,
+    read_dist,
+    scan_dists,
+    site_packages,
+)
+
+
+def test_site_packages(venv):
+    assert site_packages(venv) == str(venv / 'lib' / 'python3.10' / 'site-packages')
+    assert site_packages(venv / 'lib') is None
+
+
+def test_read_dist(venv):
+    path = os.path.join(site_packages(venv), 'requests-2.28.1.dist-info')
+    d = read_dist(path)
+    assert d.name == 'requests'
+    assert d.version == '2.28.1'
+    assert d.requires == ['idna<4,>=2.5', 'PySocks!=1.5.7; extra == "socks"']
+    assert read_dist(os.path.join(site_packages(venv), 'missing.dist-info')) is None
+
+
+def test_read_dist_license(venv, make_dist):
+    license = 'BSD 3-Clause License\n\nCopyright (c) 2015\n\nAll rights reserved.'
+    path = make_dist(
+        site_packages(venv), 'traitlets', '5.9.0', ['pytest; extra == "test"'], license
+    )
+    with open(os.path.join(path, 'METADATA')) as f:
+        assert '        \n' in f.read()
+    d = read_dist(path)
+    assert d.requires == ['pytest; extra == "test"']
+
+
+def test_scan_dists(venv):
+    dists = scan_dists(venv)
+    assert set(dists) == {'requests', 'idna', 'foo-bar'}
+    assert dists['foo-bar'].name == 'Foo_Bar'
+    assert dists['idna'].requires == []
+
+
+def test_closure(venv, make_dist):
+    sp = site_packages(venv)
+    make_dist(sp, 'PySocks', '1.7.1', ['requests'])
+    make_dist(sp, 'a', '1', ['b'])
+    make_dist(sp, 'b', '1', ['a', 'c[x]'])
+    make_dist(sp, 'c', '1', ['d; extra == "x"', 'e; extra == "y"'])
+    make_dist(sp, 'd', '1')
+    make_dist(sp, 'e', '1')
+
+    graph = DependencyGraph(scan_dists(venv))
+    assert graph.closure([('requests', set())]) == {'requests', 'idna'}
+    assert graph.closure([('requests', {'socks'})]) == {'requests', 'idna', 'pysocks'}
+    assert graph.closure([('A', set())]) == {'a', 'b', 'c', 'd'}
+    assert graph.closure([('missing', set())]) == set()
+
+
+def test_marker_env(venv):
+    assert marker_env(venv) == default_environment()
+
+    os.makedirs(venv / 'bin')
+    os.symlink(sys.executable, venv / 'bin' / 'python')
+    assert marker_env(venv) == default_environment()
+
+
+def test_closure_markers(venv, make_dist):
+    sp = site_packages(venv)
+    make_dist(
+        sp,
+        'f',
+        '1',
+        [
+            'g; extra == "x" or python_version < "3.0"',
+            'h; python_version >= "3.0"',
+            'i; sys_platform == "nonexistent"',
+        ],
+    )
+    for n in 'ghi':
+        make_dist(sp, n, '1')
+
+    graph = DependencyGraph(scan_dists(venv))
+    assert graph.closure([('f', set())]) == {'f', 'h'}
+    assert graph.closure([('f', {'x'})]) == {'f', 'g', 'h'}
+
+    env = dict(default_environment(), python_version='2.7')
+    graph = DependencyGraph(scan_dists(venv), env)
+    assert graph.closure([('f', set())]) == {'f', 'g'}
+
+
+def test_load_dists(venv, make_dist):
+    assert load_dists(venv) == scan_dists(venv)
+
+    make_dist(site_packages(venv), 'j', '1')
+    assert 'j' in load_dists(venv)
+
+
+def test_dependency_index(venv, make_dist, monkeypatch):
+    sp = site_packages(venv)
+    make_dist(sp, 'PySocks', '1.7.1')
+    make_dist(sp, 'app', '1', ['requests[socks]', 'missing'])
+
+    index = DependencyIndex()
+    assert index.update(venv, ['app'])
+    assert index.forward['requests[socks]'] == ['pysocks', 'requests']
+    assert index.children('app') == {'requests': {'socks'}, 'missing': set()}
+    assert index.reverse['pysocks'] == ['requests']
+    assert index.closure(['app']) == {'app', 'requests', 'idna', 'pysocks'}
+
+    index = DependencyIndex(index.to_json())
+    reads = []
+    read_dist = metadata.read_dist
+    monkeypatch.setattr(metadata, 'read_dist', lambda p: reads.append(p) or read_dist(p))
+    assert not index.update(venv, ['app'])
+
+    make_dist(sp, 'missing', '2', ['idna'])
+    assert index.update(venv, ['app'])
+    assert [os.path.basename(p) for p in reads] == ['missing-2.dist-info']
+    assert index.reverse['idna'] == ['missing', 'requests']
+    assert 'missing' in index.closure(['app'])
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+import sh
+
+from podao.profile import command_name, phase, profiler
+
+
+@pytest.fixture
+def profiling():
+    profiler.enable()
+    yield profiler
+    profiler.disable()
+
+
+@phase
+def steps(n):
+    for i in range(n):
+        yield i
+    return n
+
+
+@phase
+def fail():
+    raise ValueError
+
+
+def test_phase(profiling):
+    gen = steps(2)
+    assert list(gen) == [0, 1]
+    with pytest.raises(ValueError):
+        fail()
+
+    phases = [(r.name, r.status) for r in profiling.records]
+    assert phases == [('steps', 0), ('fail', 'ValueError')]
+
+
+def test_process(profiling):
+    sh.sh('-c', 'exit 0')
+    with pytest.raises(sh.ErrorReturnCode_3):
+        sh.sh('-c', 'exit 3')
+    list(sh.sh('-c', 'echo x', _iter=True))
+
+    records = [r for r in profiling.records if r.kind == 'process']
+    assert [r.status for r in records] == [0, 3, 0]
+    assert all(r.wall >= 0 and r.cpu >= 0 for r in records)
+    assert records[0].name == 'sh'
+
+    profiling.disable()
+    sh.sh('-c', 'exit 0')
+    assert len([r for r in profiling.records if r.kind == 'process']) == 3
+
+
+def test_report(profiling, tmp_path):
+    list(steps(1))
+    sh.sh('-c', 'exit 0')
+
+    lines = list(profiling.summary())
+    assert lines[0].split() == ['kind', 'name', 'calls', 'wall', 'cpu', 'failed']
+    assert {l.split()[1] for l in lines[1:-1]} == {'steps', 'sh'}
+
+    profiling.dump(tmp_path / 'trace.json', 'trace')
+    trace = json.loads((tmp_path / 'trace.json').read_text())
+    assert {e['cat'] for e in trace['traceEvents']} == {'phase', 'process'}
+    assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in trace['traceEvents'])
+
+
+def test_command_name():
+    assert command_name(['/v/bin/pip', 'install', '-U', 'x']) == 'pip install'
+    assert command_name(['/usr/bin/python3', '-m', 'venv', '.']) == 'python3'
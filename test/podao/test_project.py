@@ -1,6 +1,10 @@
+import json
 import os
 import shutil
+import subprocess
+import sys
 import tempfile
+import threading
 
 import pytest
 
@@ -15,7 +19,7 @@ from podao.constant import (
     VSCODE_DIR,
     VSCODE_FILE,
 )
-from podao.main import Package, Project
+from podao.main import Package, Project, Workspace
 
 
 def test_package():
@@ -29,6 +33,618 @@ def test_package():
     assert p.name == 'cchardet'
     assert str(p.marker) == 'python_version < "3.10" and extra == "speedups"'
 
+    assert Package('Foo_Bar>=1') is Package('Foo_Bar>=1')
+    assert Package('Foo_Bar>=1') == Package('foo-bar')
+    assert Package('Foo_Bar').key == 'foo-bar'
+    assert len({Package('Django'), Package('django>=4'), Package('DJANGO[argon2]')}) == 1
+
+
+PYPROJECT = '''\
+[project]
+name = 'demo'
+dependencies = ['requests>=2', 'click']
+
+[project.optional-dependencies]
+dev = ['pytest', 'black']
+doc = ['sphinx']
+'''
+
+
+def test_dependencies(venv):
+    (venv / PYPROJECT_FILE).write_text(PYPROJECT)
+    p = Project(venv)
+    p.add_package('pytest>=7')
+    p.add_package('mkdocs', 'doc')
+    p.add_package('requests[socks]>=2.28')
+    p.del_package('Sphinx')
+    p.del_package('mkdocs')
+    p.add_package('Black>=22', 'dev')
+    list(p._gen_pyproject())
+
+    assert p.config['project']['dependencies'] == [
+        'requests[socks]>=2.28',
+        'click',
+        'pytest>=7',
+    ]
+    assert p.config['project']['optional-dependencies'] == {'dev': ['Black>=22']}
+    assert Project(venv).get_dependencies('dev') == [Package('black')]
+
+
+def test_depends_index(venv):
+    (venv / PYPROJECT_FILE).write_text(PYPROJECT)
+    p = Project(venv)
+    assert {g: list(d) for g, d in p.depends.items()} == {
+        '': ['requests', 'click'],
+        'dev': ['pytest', 'black'],
+        'doc': ['sphinx'],
+    }
+
+    # Changes only touch the index until the pyproject is generated.
+    p.add_package('Click>=8')
+    p.add_package('pytest', None)
+    p.add_package('rich', 'cli')
+    p.del_package('SPHINX')
+    assert p.depends[''] == {
+        'requests': Package('requests'),
+        'click': Package('click'),
+        'pytest': Package('pytest'),
+    }
+    assert p.depends['']['click'].line_name == 'Click>=8'
+    assert list(p.depends['dev']) == ['black']
+    assert list(p.depends['cli']) == ['rich']
+    assert 'doc' not in p.depends
+    assert p.config['project']['optional-dependencies']['doc'] == ['sphinx']
+
+
+def test_gen_pyproject(venv):
+    text = (
+        '# demo project\n'
+        '[project]\n'
+        'name = "demo"  # keep me\n'
+        'description = "say \\"hi\\""\n'
+        'dependencies = [\n'
+        '    "requests >= 2",\n'
+        ']\n'
+        '\n'
+        '[tool.black]\n'
+        'line-length = 90\n'
+    )
+    pyproject = venv / PYPROJECT_FILE
+    pyproject.write_text(text)
+
+    p = Project(venv)
+    assert list(p._gen_pyproject()) == [f'    {PYPROJECT_FILE} unchanged']
+    assert pyproject.read_text() == text
+
+    p.add_package('click')
+    p.add_package('pytest', 'dev')
+    list(p._gen_pyproject())
+    assert pyproject.read_text() == text.replace(
+        '    "requests >= 2",\n', "    'requests>=2',\n    'click',\n"
+    ).replace(
+        '\n[tool.black]',
+        "\n[project.optional-dependencies]\ndev = ['pytest']\n\n[tool.black]",
+    )
+
+
+def test_gen_pyproject_dynamic(venv):
+    text = "[project]\nname = 'demo'\ndynamic = ['dependencies']\n"
+    pyproject = venv / PYPROJECT_FILE
+    pyproject.write_text(text)
+
+    p = Project(venv)
+    assert list(p._gen_pyproject()) == [f'    {PYPROJECT_FILE} unchanged']
+    assert pyproject.read_text() == text
+
+    p.add_package('click')
+    with pytest.raises(Exception, match='project.dynamic'):
+        list(p._gen_pyproject())
+    assert pyproject.read_text() == text
+
+
+def test_gen_pyproject_no_project(venv):
+    text = "[tool.poetry]\nname = 'demo'\n"
+    pyproject = venv / PYPROJECT_FILE
+    pyproject.write_text(text)
+
+    p = Project(venv)
+    assert list(p._gen_pyproject()) == [f'    {PYPROJECT_FILE} unchanged']
+    assert pyproject.read_text() == text
+
+    p.add_package('click')
+    list(p._gen_pyproject())
+    project = Project(venv).config['project']
+    assert project['name'] == venv.name
+    assert project['dependencies'] == ['click']
+
+
+def test_gen_pyproject_merge(venv):
+    (venv / PYPROJECT_FILE).write_text(PYPROJECT)
+    one, two = Project(venv), Project(venv)
+    one.add_package('mkdocs', 'doc')
+    one.del_package('black')
+    two.add_package('pytest-cov', 'dev')
+    two.add_package('sphinx')
+    list(one._gen_pyproject())
+    list(two._gen_pyproject())
+
+    assert two.config['project']['dependencies'] == ['requests>=2', 'click', 'sphinx']
+    assert Project(venv).config['project']['optional-dependencies'] == {
+        'dev': ['pytest', 'pytest-cov'],
+        'doc': ['mkdocs'],
+    }
+
+
+def test_offline(tmp_path, make_wheel, monkeypatch):
+    root = tmp_path / 'project'
+    subprocess.run([sys.executable, '-m', 'venv', root], check=True)
+    (root / PYPROJECT_FILE).write_text(
+        "[tool.podao]\n"
+        "targets = [{python = '3.10', platform = 'manylinux2014_x86_64'}, {}]\n"
+    )
+    index = tmp_path / 'index'
+    index.mkdir()
+    make_wheel(index)
+
+    p = Project(root, offline=True)
+    assert p.get_targets() == [
+        {
+            'python': '3.10',
+            'platforms': ['manylinux2014_x86_64'],
+            'name': 'py3.10-manylinux2014_x86_64',
+        },
+        {'platforms': [], 'name': 'default'},
+    ]
+    with pytest.raises(Exception):
+        list(p.install(['demo']))
+
+    (root / REQUIREMENTS_FILE.format(group='')).write_text('demo==1.0\n')
+    monkeypatch.setenv('PIP_NO_INDEX', '1')
+    monkeypatch.setenv('PIP_FIND_LINKS', str(index))
+    for s in Project(root).fetch():
+        print(s)
+    assert os.listdir(p.wheelhouse) == ['demo-1.0-py3-none-any.whl']
+
+    monkeypatch.delenv('PIP_FIND_LINKS')
+    for s in p.install(['demo']):
+        print(s)
+    assert p.config['project']['dependencies'] == ['demo']
+    assert (root / 'bin' / 'demo').exists()
+
+
+def test_workspace(tmp_path, make_dist):
+    for name in ('a', 'b', 'nested/c'):
+        root = tmp_path / name
+        sp = root / 'lib' / 'python3.10' / 'site-packages'
+        sp.mkdir(parents=True)
+        (root / 'pyvenv.cfg').write_text('')
+        (root / PYPROJECT_FILE).write_text(PYPROJECT)
+        make_dist(sp, 'requests', '2.28.1', ['idna'])
+        make_dist(sp, 'idna', '3.4')
+    (tmp_path / 'b' / PYPROJECT_FILE).write_text('[project')
+
+    ws = Workspace(tmp_path, 2)
+    assert ws.projects == [str(tmp_path / n) for n in ('a', 'b', 'nested/c')]
+
+    results = {os.path.basename(d): e for d, _, e in ws.run('freeze')}
+    assert results['a'] is None and results['c'] is None and results['b']
+    with open(tmp_path / 'a' / REQUIREMENTS_FILE.format(group='')) as f:
+        assert f.read() == 'idna==3.4\nrequests==2.28.1'
+
+
+def test_freeze_digest(venv, make_dist, monkeypatch):
+    (venv / PYPROJECT_FILE).write_text(PYPROJECT)
+    req_file = venv / REQUIREMENTS_FILE.format(group='')
+    assert list(Project(venv).freeze())[-1].endswith('refreshed')
+    assert req_file.read_text() == 'idna==3.4\nrequests==2.28.1'
+    mtime = req_file.stat().st_mtime_ns
+
+    def scan(self, groups, target=None):
+        raise AssertionError('snapshot recomputed')
+
+    with monkeypatch.context() as m:
+        m.setattr(Project, 'snap_groups', scan)
+        assert list(Project(venv).freeze())[-1] == '    Snapshot is up to date'
+        # The guard trips as soon as a freeze is not skipped.
+        m.setattr(Project, '_frozen', lambda self, req_file, digest: False)
+        with pytest.raises(AssertionError, match='snapshot recomputed'):
+            list(Project(venv).freeze())
+
+    # A different group or an edited snapshot is computed again, identical
+    # output is left untouched.
+    assert list(Project(venv).freeze('dev'))[-1].endswith('refreshed')
+    req_file.write_text('edited')
+    assert list(Project(venv).freeze())[-1].endswith('refreshed')
+    mtime = req_file.stat().st_mtime_ns
+    (venv / '.podao' / 'freeze.json').unlink()
+    assert list(Project(venv).freeze())[-1].endswith('unchanged')
+    assert req_file.stat().st_mtime_ns == mtime
+
+    sp = venv / 'lib' / 'python3.10' / 'site-packages'
+    # Touching the environment without installing anything keeps the digest.
+    os.utime(sp, ns=(mtime + 10**9, mtime + 10**9))
+    (venv / 'pyvenv.cfg').touch()
+    assert list(Project(venv).freeze())[-1] == '    Snapshot is up to date'
+
+    make_dist(sp, 'click', '8.1.3')
+    assert list(Project(venv).freeze())[-1].endswith('refreshed')
+    assert 'click==8.1.3' in req_file.read_text()
+
+
+def test_freeze_each(venv, make_dist, monkeypatch):
+    (venv / PYPROJECT_FILE).write_text(PYPROJECT)
+    sp = venv / 'lib' / 'python3.10' / 'site-packages'
+    make_dist(sp, 'click', '8.1.3')
+    make_dist(sp, 'pytest', '7.2.0', ['iniconfig'])
+    make_dist(sp, 'iniconfig', '1.1.1')
+    make_dist(sp, 'black', '22.12.0', ['click>=8.0.0'])
+
+    scans = []
+    original = Project.snap_groups
+
+    def snap_groups(self, groups, target=None):
+        scans.append(groups)
+        return original(self, groups, target)
+
+    monkeypatch.setattr(Project, 'snap_groups', snap_groups)
+    p = Project(venv)
+    for s in p.freeze_each():
+        print(s)
+    assert scans == [[None, 'dev', 'doc', 'all']]
+
+    main = ['click==8.1.3', 'idna==3.4', 'requests==2.28.1']
+    dev = main + ['black==22.12.0', 'iniconfig==1.1.1', 'pytest==7.2.0']
+    for group, lines in (('', main), ('-dev', dev), ('-doc', main), ('-all', dev)):
+        assert (venv / REQUIREMENTS_FILE.format(group=group)).read_text() == '\n'.join(
+            sorted(lines)
+        )
+
+    assert list(Project(venv).freeze('dev'))[-1] == '    Snapshot is up to date'
+    assert scans == [[None, 'dev', 'doc', 'all']]
+
+
+TARGETS = '''
+[tool.podao]
+targets = [
+    {python = '3.10', platform = 'manylinux2014_x86_64'},
+    {python = '3.11', platform = 'win_amd64', name = 'windows'},
+]
+'''
+
+
+def test_get_targets(venv):
+    (venv / PYPROJECT_FILE).write_text(PYPROJECT + TARGETS)
+    assert Project(venv).get_targets() == [
+        {
+            'python': '3.10',
+            'platforms': ['manylinux2014_x86_64'],
+            'name': 'py3.10-manylinux2014_x86_64',
+        },
+        {'python': '3.11', 'platforms': ['win_amd64'], 'name': 'windows'},
+    ]
+
+    (venv / PYPROJECT_FILE).write_text(PYPROJECT + TARGETS.replace("'3.10'", '3.10'))
+    with pytest.raises(Exception, match='Target python .* quoted string, got 3.1$'):
+        Project(venv).get_targets()
+    (venv / PYPROJECT_FILE).write_text(
+        PYPROJECT + TARGETS.replace("'win_amd64'", "['win_amd64', 1]")
+    )
+    with pytest.raises(Exception, match='Target platform .* got 1$'):
+        Project(venv).get_targets()
+
+
+def test_freeze_targets(venv, make_dist, make_wheel):
+    (venv / PYPROJECT_FILE).write_text(
+        PYPROJECT.replace(
+            "'click'",
+            """'click', 'tomli; python_version < "3.11"',"""
+            """ 'pywin32; sys_platform == "win32"'""",
+        )
+        + TARGETS
+    )
+    sp = venv / 'lib' / 'python3.10' / 'site-packages'
+    make_dist(
+        sp,
+        'click',
+        '8.1.3',
+        ['colorama; platform_system == "Windows"', 'tomli; python_version < "3.11"'],
+    )
+    make_dist(sp, 'tomli', '2.0.1')
+    wheelhouse = venv / 'wheelhouse'
+    wheelhouse.mkdir()
+    make_wheel(wheelhouse, 'colorama', '0.4.6')
+    os.rename(
+        make_wheel(wheelhouse, 'idna', '3.4'),
+        wheelhouse / 'idna-3.4-cp311-cp311-win_amd64.whl',
+    )
+
+    messages = list(Project(venv).freeze(targets=True))
+    warning = '    Warning: pywin32 is neither installed nor in the wheelhouse'
+    assert messages.count(warning) == 1
+    assert messages.index(warning) > messages.index(
+        f'Creating snapshot to {REQUIREMENTS_FILE.format(group="-windows")}'
+    )
+    assert '    Warning: No compatible idna==3.4 in the wheelhouse' in messages
+    assert not (venv / REQUIREMENTS_FILE.format(group='')).exists()
+
+    # Declared and transitive markers are both evaluated for the target.
+    linux = venv / REQUIREMENTS_FILE.format(group='-py3.10-manylinux2014_x86_64')
+    assert linux.read_text() == 'click==8.1.3\nidna==3.4\nrequests==2.28.1\ntomli==2.0.1'
+    windows = venv / REQUIREMENTS_FILE.format(group='-windows')
+    assert windows.read_text() == (
+        'click==8.1.3\ncolorama==0.4.6\nidna==3.4\nrequests==2.28.1'
+    )
+
+    # A line without a hash would make pip reject the whole file.
+    messages = list(Project(venv).freeze(hashes=True, targets=True))
+    assert (
+        '    Warning: No hashes written, no wheel of click==8.1.3 requests==2.28.1 '
+        'in the wheelhouse'
+    ) in messages
+    assert '--hash' not in windows.read_text()
+
+    make_wheel(wheelhouse, 'click', '8.1.3')
+    make_wheel(wheelhouse, 'requests', '2.28.1')
+    list(Project(venv).freeze(hashes=True, targets=True))
+    lines = windows.read_text().splitlines()
+    assert len(lines) == 4
+    assert all(' --hash=sha256:' in line for line in lines)
+    assert lines[1].startswith('colorama==0.4.6 --hash=sha256:')
+
+    (venv / PYPROJECT_FILE).write_text(PYPROJECT)
+    with pytest.raises(Exception):
+        list(Project(venv).freeze(targets=True))
+
+
+def fake_pip(root, fail=()):
+    # Every call is logged, a call naming any of `fail` exits with 1.
+    log = root / 'pip.log'
+    pip = root / 'bin' / 'pip'
+    pip.parent.mkdir(exist_ok=True)
+    pip.write_text(
+        f'#!/bin/sh\necho "$@" >> {log}\n'
+        f'for a; do [ -f "$a" ] && cat "$a" >> {log} && echo >> {log}; done\n'
+        + ''.join(f'for a; do [ "$a" = {k} ] && exit 1; done\n' for k in fail)
+        + 'true\n'
+    )
+    pip.chmod(0o755)
+    return log
+
+
+def test_install_batch(venv):
+    (venv / PYPROJECT_FILE).write_text(PYPROJECT)
+    log = fake_pip(venv)
+    for s in Project(venv).install(['rich', 'attrs'], 'dev'):
+        print(s)
+    assert log.read_text().splitlines() == ['install -U rich attrs']
+    dev = Project(venv).get_dependencies('dev')
+    assert Package('rich') in dev and Package('attrs') in dev
+
+
+def test_install_retry(venv):
+    (venv / PYPROJECT_FILE).write_text(PYPROJECT)
+    log = fake_pip(venv, fail=['bad'])
+    with pytest.raises(Exception, match='^Failed to install bad$'):
+        for s in Project(venv).install(['rich', 'bad', 'attrs']):
+            print(s)
+    assert log.read_text().splitlines() == [
+        'install -U rich bad attrs',
+        'install -U rich',
+        'install -U bad',
+        'install -U attrs',
+    ]
+    main = Project(venv).get_dependencies()
+    assert Package('rich') in main and Package('attrs') in main
+    assert Package('bad') not in main
+
+    # Nothing installed, nothing written.
+    log.unlink()
+    text = (venv / PYPROJECT_FILE).read_text()
+    with pytest.raises(Exception, match='^Failed to install bad$'):
+        for s in Project(venv).install(['bad']):
+            print(s)
+    assert log.read_text().splitlines() == ['install -U bad']
+    assert (venv / PYPROJECT_FILE).read_text() == text
+
+
+def test_uninstall_retry(venv):
+    (venv / PYPROJECT_FILE).write_text(PYPROJECT)
+    log = fake_pip(venv, fail=['click'])
+    with pytest.raises(Exception, match='^Failed to uninstall click$'):
+        for s in Project(venv).uninstall(['requests', 'click']):
+            print(s)
+    assert log.read_text().splitlines() == [
+        'uninstall -y requests click',
+        'uninstall -y requests',
+        'uninstall -y click',
+    ]
+    assert Project(venv).get_dependencies() == [Package('click')]
+
+
+@pytest.fixture
+def fake_pyenv(tmp_path, monkeypatch):
+    # A pyenv python 3.10.4 which logs its calls, creates the venv files and
+    # fails `pip download` with the exit code in the FAIL file, if any.
+    log = tmp_path / 'python.log'
+    root = tmp_path / 'pyenv'
+    python = root / 'versions' / '3.10.4' / 'bin' / 'python'
+    python.parent.mkdir(parents=True)
+    python.write_text(
+        f'#!/bin/sh\necho "$@" >> {log}\n'
+        'if [ "$2" = venv ]; then echo "version = 3.10.4" > pyvenv.cfg; fi\n'
+        f'if [ "$2" = pip ] && [ -f {tmp_path / "FAIL"} ]; then\n'
+        f'    echo "no network"; exit $(cat {tmp_path / "FAIL"})\nfi\n'
+    )
+    python.chmod(0o755)
+    pyenv = tmp_path / 'bin' / 'pyenv'
+    pyenv.parent.mkdir()
+    pyenv.write_text(f'#!/bin/sh\necho pyenv "$@" >> {log}\n')
+    pyenv.chmod(0o755)
+    monkeypatch.setenv('PYENV_ROOT', str(root))
+    monkeypatch.setenv('PATH', f'{pyenv.parent}{os.pathsep}{os.environ["PATH"]}')
+    return log
+
+
+def test_init(tmp_path, fake_pyenv, monkeypatch):
+    root = tmp_path / 'demo'
+    root.mkdir()
+    (root / PYPROJECT_FILE).write_text(
+        "[project]\nname = 'demo'\ndependencies = ['requests>=2']\n"
+    )
+    events = []
+
+    def recorder(name, func):
+        def wrapper(self, *args, **kwargs):
+            events.append((name, threading.current_thread() is threading.main_thread()))
+            yield from func(self, *args, **kwargs)
+            events.append((f'{name} done', None))
+
+        return wrapper
+
+    for name in ('create_structure', 'create_venv', '_gen_pyproject'):
+        monkeypatch.setattr(Project, name, recorder(name, getattr(Project, name)))
+
+    out = list(Project(root).init('3.10.4', False))
+    print('\n'.join(out))
+    # The scaffold runs beside the venv, the pyproject is written once both
+    # are done with the requires-python of the venv.
+    assert ('create_structure', False) in events
+    assert ('create_venv', True) in events
+    assert events[-2:] == [('_gen_pyproject', True), ('_gen_pyproject done', None)]
+    assert events.index(('create_structure done', None)) < len(events) - 2
+    assert events.index(('create_venv done', None)) < len(events) - 2
+    assert "requires-python = '>=3.10'" in (root / PYPROJECT_FILE).read_text()
+    assert (root / SRC_DIR).is_dir() and (root / README_FILE).is_file()
+    assert (root / 'pyvenv.cfg').is_file()
+
+    calls = fake_pyenv.read_text().splitlines()
+    assert calls[0] == 'pyenv local 3.10.4'
+    assert '-m venv .' in calls
+    assert [c.split()[-1] for c in calls if 'download' in c] == ['requests>=2']
+    assert 'Prefetching 1 declared dependencies' in out
+
+
+def test_init_prefetch(tmp_path, fake_pyenv):
+    root = tmp_path / 'demo'
+    root.mkdir()
+
+    # Nothing declared, nothing to fetch.
+    out = list(Project(root).init('3.10.4', False))
+    assert not any('download' in c for c in fake_pyenv.read_text().splitlines())
+    assert not any(s.startswith('Prefetching') for s in out)
+
+    # Offline, the wheelhouse is all there is.
+    fake_pyenv.unlink()
+    (root / 'pyvenv.cfg').unlink()
+    (root / PYPROJECT_FILE).write_text(
+        "[project]\nname = 'demo'\ndependencies = ['requests>=2']\n"
+    )
+    out = list(Project(root, offline=True).init('3.10.4', False))
+    assert not any('download' in c for c in fake_pyenv.read_text().splitlines())
+    assert not any(s.startswith('Prefetching') for s in out)
+
+    # A failed download is only a warning, the project is still set up.
+    (tmp_path / 'FAIL').write_text('1')
+    out = list(Project(root).init('3.10.4', False))
+    print('\n'.join(out))
+    assert '    no network' in out
+    assert '    Prefetching failed, packages will be downloaded on install' in out
+    assert (root / 'pyvenv.cfg').is_file()
+    assert "requires-python = '>=3.10'" in (root / PYPROJECT_FILE).read_text()
+
+
+def test_tree(venv, make_dist):
+    (venv / PYPROJECT_FILE).write_text(
+        PYPROJECT.replace("'requests>=2'", "'requests[socks]'")
+    )
+    sp = venv / 'lib' / 'python3.10' / 'site-packages'
+    make_dist(sp, 'PySocks', '1.7.1', ['idna'])
+    make_dist(sp, 'click', '8.1.3')
+    make_dist(sp, 'black', '22.12.0', ['click>=8.0.0'])
+
+    p = Project(venv)
+    assert list(p.tree()) == [
+        'click==8.1.3',
+        'requests[socks]==2.28.1',
+        '    idna==3.4',
+        '    PySocks==1.7.1',
+        '        idna==3.4',
+    ]
+    assert list(p.tree('dev'))[:4] == [
+        'black==22.12.0',
+        '    click==8.1.3',
+        'click==8.1.3',
+        'pytest (not installed)',
+    ]
+    assert list(p.why('click')) == [
+        'click==8.1.3 (dependencies)',
+        '    black==22.12.0 (dev)',
+    ]
+    assert list(p.why('idna')) == [
+        'idna==3.4',
+        '    PySocks==1.7.1',
+        '        requests==2.28.1 (dependencies)',
+        '    requests==2.28.1 (dependencies)',
+    ]
+    assert list(p.why('foo-bar')) == ['Foo_Bar==1.0 (not required)']
+    assert (venv / '.podao' / 'index.json').exists()
+
+
+def test_uninstall_prune(venv, make_dist):
+    (venv / PYPROJECT_FILE).write_text(PYPROJECT.replace("'click'", "'idna'"))
+    sp = venv / 'lib' / 'python3.10' / 'site-packages'
+    make_dist(sp, 'urllib3', '1.26.13')
+    make_dist(sp, 'certifi', '2022.12.7')
+    make_dist(sp, 'other', '1', ['certifi'])
+    shutil.rmtree(sp / 'requests-2.28.1.dist-info')
+    make_dist(sp, 'requests', '2.28.1', ['idna', 'urllib3', 'certifi'])
+    log = fake_pip(venv)
+
+    for s in Project(venv).uninstall(['requests'], prune=True):
+        print(s)
+    assert log.read_text().splitlines() == ['uninstall -y requests urllib3']
+    assert Project(venv).get_dependencies() == [Package('idna')]
+
+
+def test_sync(venv):
+    log = fake_pip(venv)
+    req_file = venv / REQUIREMENTS_FILE.format(group='')
+    req_file.write_text('# snapshot\nfoo-bar==1.0\nidna==3.4\nrequests==2.28.1\n')
+    for s in Project(venv).sync():
+        print(s)
+    assert not log.exists()
+
+    req_file.write_text(
+        'idna==3.4\nrequests==2.28.2 --hash=sha256:abc\nurllib3==1.26.13\n'
+    )
+    for s in Project(venv).sync():
+        print(s)
+    lines = log.read_text().splitlines()
+    assert lines[0] == 'uninstall -y Foo_Bar'
+    assert lines[1].startswith('install --no-deps -r ')
+    assert lines[2:] == ['requests==2.28.2 --hash=sha256:abc', 'urllib3==1.26.13']
+
+
+def test_sync_editable(venv, make_dist):
+    log = fake_pip(venv)
+    sp = venv / 'lib/python3.10/site-packages'
+    make_dist(sp, 'mylib', '0.1')
+    (sp / 'mylib-0.1.dist-info/direct_url.json').write_text(
+        json.dumps({'url': 'file:///src/mylib', 'dir_info': {'editable': True}})
+    )
+    req_file = venv / REQUIREMENTS_FILE.format(group='')
+    req_file.write_text('foo-bar==1.0\nidna==3.*\nrequests==2.28.1\n')
+    for s in Project(venv).sync():
+        print(s)
+    assert not log.exists()
+
+    req_file.write_text('foo-bar==1.0\nidna==2.*\nrequests==2.28.1\n')
+    for s in Project(venv).sync():
+        print(s)
+    lines = log.read_text().splitlines()
+    assert lines[0].startswith('install --no-deps -r ')
+    assert lines[1:] == ['idna==2.*']
+
 
 @pytest.fixture(scope='module')
 def project():
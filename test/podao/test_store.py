@@ -0,0 +1,57 @@
+import csv
+import os
+
+import pytest
+
+from podao.store import WheelStore, link_file
+
+
+@pytest.fixture
+def store(tmp_path):
+    return WheelStore(str(tmp_path / 'store'))
+
+
+def test_link_file(tmp_path):
+    src = tmp_path / 'src'
+    src.write_text('data')
+    assert link_file(src, tmp_path / 'dst') == 'link'
+    assert os.path.samefile(src, tmp_path / 'dst')
+
+
+def test_store_add(store, tmp_path, make_wheel):
+    tree = store.add(make_wheel(tmp_path))
+    assert store.add(make_wheel(tmp_path)) == tree
+    assert os.path.isfile(os.path.join(tree, 'demo', '__init__.py'))
+    assert os.listdir(store.wheels) == ['demo-1.0-py3-none-any.whl']
+    assert store.linkable(tree)
+
+    data = tmp_path / 'data'
+    data.mkdir()
+    assert not store.linkable(store.add(make_wheel(data, data=True)))
+
+
+def test_store_link(store, tmp_path, make_wheel):
+    tree = store.add(make_wheel(tmp_path))
+    sp = tmp_path / 'venv' / 'lib' / 'python3.10' / 'site-packages'
+    bin = tmp_path / 'venv' / 'bin'
+    sp.mkdir(parents=True)
+    bin.mkdir()
+
+    dist_info = store.link(tree, str(sp), str(bin))
+    assert os.path.samefile(
+        sp / 'demo' / '__init__.py', os.path.join(tree, 'demo', '__init__.py')
+    )
+    assert not os.path.samefile(
+        os.path.join(dist_info, 'RECORD'),
+        os.path.join(tree, 'demo-1.0.dist-info', 'RECORD'),
+    )
+    assert os.access(bin / 'demo', os.X_OK)
+    assert (bin / 'demo').read_text().startswith(f'#!{bin / "python"}\n')
+
+    with open(os.path.join(dist_info, 'RECORD')) as f:
+        records = [r[0] for r in csv.reader(f)]
+    assert records == [
+        'demo/__init__.py',
+        'demo-1.0.dist-info/INSTALLER',
+        os.path.join('..', '..', '..', 'bin', 'demo'),
+    ]
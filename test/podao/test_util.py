@@ -0,0 +1,141 @@
+import os
+import threading
+
+import pytest
+import sh
+
+from podao.util import (
+    _find_pyvenv,
+    atomic_write,
+    cache_dir,
+    check_pyvenv,
+    disk_cache,
+    file_lock,
+    mtimes,
+    stream,
+)
+
+
+def test_disk_cache(cache_home, tmp_path):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'value': len(calls)}
+
+    stamp = tmp_path / 'stamp'
+    stamp.write_text('')
+    assert disk_cache('key', mtimes(stamp), compute) == {'value': 1}
+    assert disk_cache('key', mtimes(stamp), compute) == {'value': 1}
+    assert len(calls) == 1
+    assert cache_dir().startswith(str(cache_home))
+
+    os.utime(stamp, ns=(0, 0))
+    assert disk_cache('key', mtimes(stamp), compute) == {'value': 2}
+    assert disk_cache('other', mtimes(stamp), compute) == {'value': 3}
+    assert mtimes(tmp_path / 'missing') == [None]
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / 'file'
+    with atomic_write(path) as f:
+        f.write('one')
+    assert path.read_text() == 'one'
+    assert path.stat().st_mode & 0o777 == 0o666 & ~current_umask()
+
+    path.chmod(0o640)
+    with atomic_write(path) as f:
+        f.write('two')
+    assert path.read_text() == 'two'
+    assert path.stat().st_mode & 0o777 == 0o640
+
+    with atomic_write(path, overwrite=False) as f:
+        assert f is False
+
+    try:
+        with atomic_write(path) as f:
+            f.write('three')
+            raise ValueError
+    except ValueError:
+        pass
+    assert path.read_text() == 'two'
+    assert os.listdir(tmp_path) == ['file']
+
+
+def current_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def test_file_lock(tmp_path):
+    path = tmp_path / '.podao' / 'test.lock'
+    events = []
+
+    def work():
+        with file_lock(path):
+            events.append('thread')
+
+    with file_lock(path):
+        t = threading.Thread(target=work)
+        t.start()
+        t.join(0.2)
+        events.append('main')
+    t.join()
+    assert events == ['main', 'thread']
+
+
+def test_check_pyvenv(tmp_path, monkeypatch):
+    monkeypatch.delenv('VIRTUAL_ENV', raising=False)
+    monkeypatch.delenv('PODAO_SEARCH_DEPTH', raising=False)
+    _find_pyvenv.cache_clear()
+    venv = tmp_path / 'venv'
+    deep = venv / 'src' / 'pkg' / 'sub'
+    deep.mkdir(parents=True)
+    (venv / 'pyvenv.cfg').write_text('')
+
+    monkeypatch.chdir(deep)
+    assert check_pyvenv() == str(venv)
+    assert check_pyvenv(venv) == str(venv)
+    assert check_pyvenv(depth=2) is False
+    monkeypatch.setenv('PODAO_SEARCH_DEPTH', '3')
+    assert check_pyvenv() == str(venv)
+
+    # A nested project without an environment stops the search.
+    (deep / 'pyproject.toml').write_text('')
+    assert check_pyvenv(deep / 'new') is False
+
+    other = tmp_path / 'other'
+    other.mkdir()
+    (other / 'pyvenv.cfg').write_text('')
+    monkeypatch.setenv('VIRTUAL_ENV', str(other))
+    assert check_pyvenv() == str(other)
+    assert check_pyvenv(active=False) == str(venv)
+
+
+def test_stream(tmp_path):
+    go = tmp_path / 'go'
+    script = tmp_path / 'step'
+    script.write_text(
+        '#!/bin/sh\necho one\necho two >&2\n'
+        f'while [ ! -f {go} ]; do sleep 0.01; done\n'
+        'echo three\nexit "$1"\n'
+    )
+    script.chmod(0o755)
+
+    # Lines arrive while the command is still blocked on `go`.
+    lines = stream(sh.Command(script), 0)
+    assert [next(lines), next(lines)] == ['    one', '    two']
+    go.touch()
+    assert next(lines) == '    three'
+    assert next(lines).startswith('    Done in ')
+    assert list(lines) == []
+
+    lines = stream(sh.Command(script), 3)
+    assert list(zip(range(3), lines)) == [
+        (0, '    one'),
+        (1, '    two'),
+        (2, '    three'),
+    ]
+    with pytest.raises(sh.ErrorReturnCode_3):
+        next(lines)